@@ -0,0 +1,186 @@
+import os
+import json
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from timeline import ACTIONS, Timeline, to_timestamp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Worker processes that parse and tally stored merge requests, 0 or 1 aggregates in the server process
+GITLAB_AGGREGATION_WORKERS = int(os.environ.get('GITLAB_AGGREGATION_WORKERS', os.cpu_count() or 1))
+GITLAB_AGGREGATION_CHUNK_SIZE = int(os.environ.get('GITLAB_AGGREGATION_CHUNK_SIZE', 250))
+
+logger = logging.getLogger(__name__)
+
+def loads(data):
+    """
+    Decodes JSON with orjson when it is installed, falling back to the standard library
+    :param data: JSON text or bytes
+    :return: Decoded value
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def add_merge_request_activity(contributors, mr, notes, commits):
+    """
+    Adds one merge request's opens, commits, comments and reactions to the contributor
+    totals in a single pass over its notes and commits
+    :param contributors: Dictionary of username -> participation details, updated in place
+    :param mr: Merge request dictionary
+    :param notes: Notes of the merge request
+    :param commits: Commits of the merge request
+    """
+    created_at = to_timestamp(mr['created_at'])
+    author = mr['author']['username']
+    author_data = get_contributor(contributors, author, mr['author'].get('name'))
+    author_data['opened'] += 1
+    author_data['timeline'].append(created_at, 'opened')
+
+    participants = set()
+    for comment in notes:
+        commenter = comment['author']['username']
+        comment_date = to_timestamp(comment['created_at'])
+        participants.add(commenter)
+        commenter_data = get_contributor(contributors, commenter, comment['author'].get('name'))
+        commenter_data['commented'] += 1
+        commenter_data['timeline'].append(comment_date, 'commented')
+        for emoji in comment.get('award_emoji', []):
+            reactor = emoji['user']['username']
+            participants.add(reactor)
+            reactor_data = get_contributor(contributors, reactor)
+            reactor_data['reacted'] += 1
+            reactor_data['timeline'].append(comment_date, 'reacted')
+    for commit in commits:
+        participants.add(commit['author_name'])
+
+    participants.discard(author)
+    for participant in participants:
+        participant_data = get_contributor(contributors, participant)
+        participant_data['committed'] += 1
+        participant_data['timeline'].append(created_at, 'committed')
+
+def get_contributor(contributors, username, name=None):
+    """
+    Returns the participation details of a contributor, creating them on first sight
+    :param contributors: Dictionary of username -> participation details
+    :param username: Username of the contributor
+    :param name: Optional display name of the contributor
+    :return: Participation details dictionary
+    """
+    data = contributors.get(username)
+    if data is None:
+        data = contributors[username] = {'name': None, 'opened': 0, 'committed': 0, 'commented': 0, 'reacted': 0, 'timeline': Timeline()}
+    if name and data['name'] is None:
+        data['name'] = name
+    return data
+
+def merge_contributors(contributors, partial):
+    """
+    Adds partial participation details, e.g. from a worker process, to the contributor totals
+    :param contributors: Dictionary of username -> participation details, updated in place
+    :param partial: Dictionary of username -> participation details to add
+    """
+    for username, data in partial.items():
+        target = get_contributor(contributors, username, data['name'])
+        for action in ACTIONS:
+            target[action] += data[action]
+        target['timeline'].extend(data['timeline'])
+
+def subtract_contributors(contributors, partial):
+    """
+    Removes partial participation details, e.g. a merge request's earlier activity, from the
+    contributor totals. Contributors left without events are dropped.
+    :param contributors: Dictionary of username -> participation details, updated in place
+    :param partial: Dictionary of username -> participation details to remove
+    """
+    for username, data in partial.items():
+        target = contributors.get(username)
+        if target is None:
+            continue
+        for action in ACTIONS:
+            target[action] -= data[action]
+        target['timeline'].remove(data['timeline'])
+        if not len(target['timeline']):
+            del contributors[username]
+
+def tally_merge_requests(rows):
+    """
+    Parses raw stored merge requests and tallies their activity. Runs in a
+    worker process, so it only depends on the raw rows and returns plain data.
+    :param rows: Iterable of (merge request JSON, [(note ID, note JSON)], {note ID: [reactor usernames]}, [commit author names])
+                 as returned by MergeRequestStore.get_raw_activity
+    :return: Dictionary of username -> participation details
+    """
+    contributors = {}
+    for mr_data, note_rows, emoji, commit_authors in rows:
+        notes = []
+        for note_id, note_data in note_rows:
+            note = loads(note_data)
+            note['award_emoji'] = [{'user': {'username': username}} for username in emoji.get(note_id, ())]
+            notes.append(note)
+        commits = [{'author_name': author_name} for author_name in commit_authors]
+        add_merge_request_activity(contributors, loads(mr_data), notes, commits)
+    return contributors
+
+async def tally_in_pool(rows, workers=None):
+    """
+    Tallies raw stored merge requests in chunks of GITLAB_AGGREGATION_CHUNK_SIZE
+    across the worker pool and merges the partial results. The event loop keeps
+    serving requests while the workers run. Inputs of one chunk are tallied in
+    place; with fewer than two workers larger inputs are tallied on a thread.
+    :param rows: List of raw rows, see tally_merge_requests
+    :param workers: Number of worker processes, defaults to GITLAB_AGGREGATION_WORKERS
+    :return: Dictionary of username -> participation details
+    """
+    workers = GITLAB_AGGREGATION_WORKERS if workers is None else workers
+    chunk_size = max(1, GITLAB_AGGREGATION_CHUNK_SIZE)
+    if len(rows) <= chunk_size:
+        return tally_merge_requests(rows)
+    loop = asyncio.get_running_loop()
+    if workers < 2:
+        return await loop.run_in_executor(None, tally_merge_requests, rows)
+    chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+    pool = get_pool(workers)
+    try:
+        partials = await asyncio.gather(*(loop.run_in_executor(pool, tally_merge_requests, chunk) for chunk in chunks))
+    except BrokenProcessPool as error:
+        # A crashed worker breaks the whole pool; start a new one next time and finish this tally here
+        logger.error(f"Aggregation pool broke, tallying in process: {str(error)}")
+        close_pool()
+        return await loop.run_in_executor(None, tally_merge_requests, rows)
+    contributors = {}
+    for partial in partials:
+        merge_contributors(contributors, partial)
+    return contributors
+
+_pool = None
+
+def get_pool(workers=None):
+    """
+    Returns the shared worker pool, starting it on first use. Workers are spawned
+    rather than forked so they don't inherit the server's event loop and connections.
+    :param workers: Number of worker processes, defaults to GITLAB_AGGREGATION_WORKERS
+    :return: ProcessPoolExecutor
+    """
+    global _pool
+    if _pool is None:
+        workers = workers or GITLAB_AGGREGATION_WORKERS
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        logger.info(f"Started aggregation pool with {workers} workers (orjson={orjson is not None})")
+    return _pool
+
+def close_pool():
+    """
+    Shuts the worker pool down
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
@@ -1,8 +1,23 @@
 import os
+import json
+import time
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from gitlab_scanner import REPOSITORY_URL, GITLAB_TOKEN, get_project_id, scan_gitlab_repository, get_merge_requests_with_participants, get_repo_url, set_repo_url, get_all_contributors, get_total_merge_requests, get_open_merge_requests_count
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from gitlab_client import close_client
+from aggregation import close_pool
+from jobs import job_manager
+from rate_limiter import get_rate_limit_stats
+from metrics import METRICS_TRACE, Counter, Gauge, Histogram, render_metrics, trace
+from timeline import ACTIONS, format_contributors
+from records import MergeRequestRecord, parse_fields
+from leaderboard import materialize_leaderboards, get_leaderboards
+from snapshot import load_snapshot_dir
+from webhooks import GITLAB_WEBHOOK_SECRET, WEBHOOK_EVENTS, webhook_processor, verify_token
+from gitlab_scanner import REPOSITORY_URL, GITLAB_TOKEN, FETCH_BACKENDS, get_project_id, iter_gitlab_repository, iter_merge_requests_with_participants, get_repo_url, set_repo_url, get_all_contributors, get_group_projects, get_group_contributors, get_total_merge_requests, get_open_merge_requests_count, invalidate_caches, get_cache_stats
 
 # Set up logging
 logging.basicConfig(
@@ -31,6 +46,89 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+GZIP_MINIMUM_SIZE = int(os.environ.get('GZIP_MINIMUM_SIZE', 1000))
+
+class ResponseGZipMiddleware(GZipMiddleware):
+    """
+    Compresses responses, except server-sent event streams, which must reach the client event by event
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].endswith('/events'):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(ResponseGZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
+HTTP_REQUEST_DURATION = Histogram('gitlab_scanner_http_request_duration_seconds', 'Latency of API requests until the response starts', ('method', 'route', 'status'))
+CACHE_LOOKUPS = Counter('gitlab_scanner_cache_lookups_total', 'Cache lookups by result', ('cache', 'result'), collect=lambda: {
+    (name, result): stats[result]
+    for name, stats in get_cache_stats().items()
+    for result in ('hits', 'revalidated', 'misses') if result in stats
+})
+CACHE_HIT_RATIO = Gauge('gitlab_scanner_cache_hit_ratio', 'Share of cache lookups answered without a GitLab request', ('cache',), collect=lambda: {
+    (name,): stats['hit_ratio'] for name, stats in get_cache_stats().items()
+})
+SCAN_JOBS = Gauge('gitlab_scanner_scan_jobs', 'Background scan jobs by status', ('status',), collect=lambda: {
+    (status,): count for status, count in job_manager.status_counts().items()
+})
+GITLAB_RATE_LIMIT = Gauge('gitlab_scanner_gitlab_rate_limit', 'Current GitLab request rate allowed per second', ('token',), collect=lambda: {
+    (token,): stats['rate'] for token, stats in get_rate_limit_stats().items()
+})
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    """
+    Records the latency of every request per route. With METRICS_TRACE set, or an
+    X-Trace: 1 request header, the call tree of the request is logged as well.
+    """
+    start = time.perf_counter()
+    if METRICS_TRACE or request.headers.get('X-Trace') == '1':
+        with trace(f"{request.method} {request.url.path}"):
+            response = await call_next(request)
+    else:
+        response = await call_next(request)
+    route = request.scope.get('route')
+    HTTP_REQUEST_DURATION.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route.path if route is not None else 'unmatched',
+        status=response.status_code,
+    )
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Expose metrics in the Prometheus text format
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+_snapshot_import = None
+
+@app.on_event("startup")
+async def startup():
+    """
+    Starts loading the snapshots in GITLAB_SNAPSHOT_DIR in the background and starts the webhook processor
+    when a webhook secret is configured. Until a project's snapshot is loaded, its reads fall through to a scan.
+    """
+    global _snapshot_import
+    _snapshot_import = asyncio.ensure_future(load_snapshot_dir())
+    if GITLAB_WEBHOOK_SECRET:
+        webhook_processor.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    Stops the snapshot import and the webhook processor, closes pooled GitLab connections and stops the aggregation workers on shutdown
+    """
+    if _snapshot_import is not None:
+        _snapshot_import.cancel()
+    await webhook_processor.stop()
+    await close_client()
+    close_pool()
+
 @app.get("/")
 async def root():
     """
@@ -40,14 +138,55 @@ async def root():
 
 from fastapi import Query
 
+async def _stream_items(items, output_format):
+    """
+    Streams an async generator of items as a JSON array or as NDJSON.
+    The first item is read before the response starts so that errors
+    raised up front still map to an HTTP error status. A later error ends
+    NDJSON with an {"error": ...} record and aborts a JSON array before its
+    closing bracket, so that clients can't mistake a partial list for a full one.
+    """
+    if output_format not in ('json', 'ndjson'):
+        raise ValueError("format must be 'json' or 'ndjson'")
+    try:
+        first = _encodable(await items.__anext__())
+    except StopAsyncIteration:
+        first = None
+
+    async def body():
+        if output_format == 'json':
+            yield '['
+        try:
+            if first is not None:
+                yield json.dumps(first, default=str) if output_format == 'json' else json.dumps(first, default=str) + '\n'
+                async for item in items:
+                    item = _encodable(item)
+                    yield ',' + json.dumps(item, default=str) if output_format == 'json' else json.dumps(item, default=str) + '\n'
+        except Exception as error:
+            logger.error(f"Error while streaming response: {str(error)}")
+            if output_format == 'json':
+                raise
+            yield json.dumps({'error': str(error)}) + '\n'
+            return
+        if output_format == 'json':
+            yield ']'
+
+    media_type = 'application/json' if output_format == 'json' else 'application/x-ndjson'
+    return StreamingResponse(body(), media_type=media_type)
+
+def _encodable(item):
+    return item.to_dict() if isinstance(item, MergeRequestRecord) else item
+
 @app.get("/api/merge-requests")
-async def get_merge_requests(total: int = Query(10, ge=1), max_age: int = Query(30, ge=1), repository_url: str = Query(...)):
+async def get_merge_requests(total: int = Query(10, ge=1), max_age: int = Query(30, ge=1), repository_url: str = Query(...), output_format: str = Query('json', alias='format'), fields: str = Query(None)):
     """
-    Get merge requests
+    Get merge requests, streamed as a JSON array or as NDJSON (format=ndjson).
+    fields=iid,title,... (or fields=slim) returns only those fields of each merge request, with the author as a username.
     """
     try:
-        merge_requests = scan_gitlab_repository(total, max_age, repository_url)
-        return merge_requests
+        return await _stream_items(iter_gitlab_repository(total, max_age, repository_url, parse_fields(fields)), output_format)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as error:
         logger.error(f"Error in get_merge_requests: {str(error)}")
         if 'Unauthorized' in str(error):
@@ -58,14 +197,18 @@ async def get_merge_requests(total: int = Query(10, ge=1), max_age: int = Query(
             raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
 
 @app.get("/api/merge-requests-with-participants")
-async def get_merge_requests_participants(total: int = Query(10, ge=1), max_age: int = Query(30, ge=1), repository_url: str = Query(...)):
+async def get_merge_requests_participants(total: int = Query(10, ge=1), max_age: int = Query(30, ge=1), repository_url: str = Query(...), concurrency: int = Query(None, ge=1), backend: str = Query(None), output_format: str = Query('json', alias='format'), fields: str = Query(None)):
     """
-    Get merge requests with their participants
+    Get merge requests with their participants, streamed as a JSON array or as NDJSON (format=ndjson).
+    backend=rest|graphql selects how notes and commits are fetched; fields works as in /api/merge-requests.
     """
     try:
-        project_id = get_project_id(repository_url)
-        merge_requests = get_merge_requests_with_participants(project_id, total, max_age, repository_url)
-        return merge_requests
+        fields = parse_fields(fields)
+        project_id = await get_project_id(repository_url)
+        merge_requests = iter_merge_requests_with_participants(project_id, total, max_age, repository_url, concurrency, backend, fields)
+        return await _stream_items(merge_requests, output_format)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as error:
         logger.error(f"Error in get_merge_requests_participants: {str(error)}")
         if 'Unauthorized' in str(error):
@@ -100,14 +243,25 @@ async def set_repository_url(repo_url: str = Body(..., embed=True)):
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
 
 @app.get("/api/contributors")
-async def get_contributors(repository_url: str = Query(...)):
+async def get_contributors(repository_url: str = Query(...), concurrency: int = Query(None, ge=1), backend: str = Query(None), members_only: bool = Query(False), bucket: str = Query(None), events: bool = Query(False)):
     """
-    Get all contributors with participation details
+    Get all contributors with participation details.
+    bucket=day|week|month adds per-contributor activity histograms; events=true adds the raw columnar events.
+    backend=rest|graphql selects how notes and commits are fetched; members_only=true keeps the roster in members.txt.
     """
     try:
-        project_id = get_project_id(repository_url)
-        contributors, total_time = get_all_contributors(project_id, repository_url)
-        return {"contributors": contributors, "estimated_time": total_time}
+        project_id = await get_project_id(repository_url)
+        stats = {}
+        contributors, total_time = await get_all_contributors(project_id, repository_url, concurrency, stats=stats, backend=backend, members_only=members_only)
+        materialize_leaderboards(repository_url, contributors, members_only)
+        return {
+            "contributors": format_contributors(contributors, bucket, events),
+            "timeline_actions": ACTIONS,
+            "estimated_time": total_time,
+            "stats": stats,
+        }
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as error:
         logger.error(f"Error in get_contributors: {str(error)}")
         if 'Unauthorized' in str(error):
@@ -117,15 +271,143 @@ async def get_contributors(repository_url: str = Query(...)):
         else:
             raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
 
+@app.post("/api/contributors/jobs")
+async def start_contributors_job(repository_url: str = Body(..., embed=True), concurrency: int = Body(None, embed=True, ge=1), backend: str = Body(None, embed=True), members_only: bool = Body(False, embed=True)):
+    """
+    Start a background contributor scan, or join the one already running for the repository
+    """
+    if backend is not None and backend not in FETCH_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"backend must be one of {', '.join(FETCH_BACKENDS)}")
+    try:
+        job = job_manager.start_contributor_scan(repository_url, concurrency, backend, members_only=members_only)
+        return job.to_dict(members_only=members_only)
+    except Exception as error:
+        logger.error(f"Error in start_contributors_job: {str(error)}")
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
+
+@app.get("/api/leaderboards")
+async def get_leaderboards_endpoint(repository_url: str = Query(...), window: str = Query('all'), metric: str = Query(None), top: int = Query(10, ge=1), members_only: bool = Query(False)):
+    """
+    Get the top contributors per metric (total, opened, committed, commented, reacted) as chart-ready series.
+    Served from the leaderboards materialized by the latest contributor scan of the repository or group;
+    window=7d|30d|90d|all restricts the counts to recent activity.
+    """
+    leaderboards = get_leaderboards(repository_url, members_only)
+    if leaderboards is None:
+        raise HTTPException(status_code=404, detail="No contributor scan found for this repository. Please run a scan first.")
+    try:
+        return leaderboards.to_dict(window, metric, top)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+@app.get("/api/groups/projects")
+async def get_group_projects_endpoint(group_url: str = Query(...)):
+    """
+    List the projects of a group and its subgroups
+    """
+    try:
+        projects = await get_group_projects(group_url)
+        return {"projects": projects, "total": len(projects)}
+    except Exception as error:
+        logger.error(f"Error in get_group_projects_endpoint: {str(error)}")
+        if 'Unauthorized' in str(error):
+            raise HTTPException(status_code=401, detail="Unauthorized. Please check your GitLab token.")
+        elif 'Group not found' in str(error):
+            raise HTTPException(status_code=404, detail="Group not found. Please check your group URL.")
+        else:
+            raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
+
+@app.get("/api/group-contributors")
+async def get_group_contributors_endpoint(group_url: str = Query(...), concurrency: int = Query(None, ge=1), project_concurrency: int = Query(None, ge=1), backend: str = Query(None), members_only: bool = Query(False), bucket: str = Query(None), events: bool = Query(False)):
+    """
+    Get contributors merged across every project of a group.
+    Takes the same options as /api/contributors; project_concurrency limits how many projects are crawled at once.
+    """
+    try:
+        stats = {}
+        contributors, total_time = await get_group_contributors(group_url, concurrency, stats=stats, backend=backend,
+                                                                members_only=members_only, project_concurrency=project_concurrency)
+        materialize_leaderboards(group_url, contributors, members_only)
+        return {
+            "contributors": format_contributors(contributors, bucket, events),
+            "timeline_actions": ACTIONS,
+            "estimated_time": total_time,
+            "stats": stats,
+        }
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as error:
+        logger.error(f"Error in get_group_contributors_endpoint: {str(error)}")
+        if 'Unauthorized' in str(error):
+            raise HTTPException(status_code=401, detail="Unauthorized. Please check your GitLab token.")
+        elif 'Group not found' in str(error):
+            raise HTTPException(status_code=404, detail="Group not found. Please check your group URL.")
+        else:
+            raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
+
+@app.post("/api/group-contributors/jobs")
+async def start_group_contributors_job(group_url: str = Body(..., embed=True), concurrency: int = Body(None, embed=True, ge=1), backend: str = Body(None, embed=True), members_only: bool = Body(False, embed=True)):
+    """
+    Start a background contributor scan of every project in a group.
+    Progress and the result are read through the /api/contributors/jobs endpoints.
+    """
+    if backend is not None and backend not in FETCH_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"backend must be one of {', '.join(FETCH_BACKENDS)}")
+    try:
+        job = job_manager.start_contributor_scan(group_url, concurrency, backend, scope='group', members_only=members_only)
+        return job.to_dict(members_only=members_only)
+    except Exception as error:
+        logger.error(f"Error in start_group_contributors_job: {str(error)}")
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
+
+@app.get("/api/contributors/jobs/{job_id}")
+async def get_contributors_job(job_id: str, bucket: str = Query(None), events: bool = Query(False), members_only: bool = Query(False)):
+    """
+    Get the status of a contributor scan, including the result once it has completed.
+    bucket and events shape the contributor timelines as in /api/contributors; members_only=true keeps the roster in members.txt.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    try:
+        data = job.to_dict(include_result=True, members_only=members_only)
+    except Exception as error:
+        logger.error(f"Error in get_contributors_job: {str(error)}")
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
+    if 'result' in data:
+        try:
+            contributors = format_contributors(data['result']['contributors'], bucket, events)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        data['result'] = {**data['result'], 'contributors': contributors, 'timeline_actions': ACTIONS}
+    return data
+
+@app.get("/api/contributors/jobs/{job_id}/events")
+async def stream_contributors_job(job_id: str, members_only: bool = Query(False)):
+    """
+    Stream the progress of a contributor scan as server-sent events
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return StreamingResponse(
+        job_manager.events(job, members_only),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/total-merge-requests")
 async def get_total_merge_requests_endpoint(repository_url: str = Query(...)):
     """
-    Get the total number of merge requests for the repository
+    Get the total number of merge requests for the repository. estimated_time is derived from the
+    sync throughput of the latest scan of this repository that fetched merge requests from GitLab,
+    and is null until such a scan has completed.
     """
     try:
-        project_id = get_project_id(repository_url)
-        total_mrs = get_total_merge_requests(project_id, repository_url)
-        estimated_time = total_mrs * 1.5  # 1.5 seconds per MR
+        project_id = await get_project_id(repository_url)
+        total_mrs = await get_total_merge_requests(project_id, repository_url)
+        rate = job_manager.measured_rate(repository_url)
+        estimated_time = total_mrs / rate if rate else None
         return {"total_merge_requests": total_mrs, "estimated_time": estimated_time}
     except Exception as error:
         logger.error(f"Error in get_total_merge_requests_endpoint: {str(error)}")
@@ -146,8 +428,8 @@ async def get_open_merge_requests_count_endpoint(repository_url: str = Query(Non
             repository_url = get_repo_url()
         if not repository_url:
             raise ValueError("repository_url is not set")
-        project_id = get_project_id(repository_url)
-        open_mrs_count = get_open_merge_requests_count(project_id)
+        project_id = await get_project_id(repository_url)
+        open_mrs_count = await get_open_merge_requests_count(project_id, repository_url)
         return {"open_merge_requests_count": open_mrs_count}
     except ValueError as ve:
         logger.error(f"Error in get_open_merge_requests_count: {str(ve)}")
@@ -161,6 +443,64 @@ async def get_open_merge_requests_count_endpoint(repository_url: str = Query(Non
         else:
             raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
 
+@app.post("/api/webhooks/gitlab", status_code=202)
+async def gitlab_webhook(request: Request, x_gitlab_token: str = Header(None), x_gitlab_event: str = Header(None)):
+    """
+    Receive GitLab Merge Request, Note and Emoji hooks. Events are queued and applied to the
+    store in the background; other events are acknowledged and ignored.
+    """
+    if not GITLAB_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhooks are not enabled. Please set GITLAB_WEBHOOK_SECRET.")
+    if not verify_token(x_gitlab_token):
+        raise HTTPException(status_code=401, detail="Invalid webhook token.")
+    kind = WEBHOOK_EVENTS.get(x_gitlab_event)
+    if kind is None:
+        return {"queued": False, "detail": f"Ignored event: {x_gitlab_event}"}
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook payload is not valid JSON.")
+    if not isinstance(payload, dict) or payload.get('object_kind') != kind or 'project' not in payload:
+        raise HTTPException(status_code=400, detail=f"Payload does not match the {x_gitlab_event} event.")
+    try:
+        return {"queued": webhook_processor.enqueue(kind, payload)}
+    except Exception as error:
+        logger.error(f"Error in gitlab_webhook: {str(error)}")
+        raise HTTPException(status_code=503, detail=f"Service Unavailable: {str(error)}")
+
+@app.get("/api/webhooks/stats")
+async def get_webhook_stats():
+    """
+    Get the webhook queue size, event counts by outcome and the result of the last reconciliation
+    """
+    return webhook_processor.stats()
+
+@app.get("/api/gitlab/rate-limit")
+async def get_rate_limit_endpoint():
+    """
+    Get the current GitLab request rate, throughput and throttle state per token
+    """
+    return get_rate_limit_stats()
+
+@app.get("/api/cache/stats")
+async def get_cache_stats_endpoint():
+    """
+    Get hit/miss statistics for the project and count caches and hit/revalidated/miss statistics for the HTTP cache
+    """
+    return get_cache_stats()
+
+@app.post("/api/cache/invalidate")
+async def invalidate_cache_endpoint(repository_url: str = Body(None, embed=True)):
+    """
+    Invalidate cached project details and counts, for one repository or all of them
+    """
+    try:
+        removed = await invalidate_caches(repository_url)
+        return {"invalidated": removed}
+    except Exception as error:
+        logger.error(f"Error in invalidate_cache_endpoint: {str(error)}")
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(error)}")
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 9002))
@@ -0,0 +1,293 @@
+"""
+Stand-in for the GitLab REST and GraphQL APIs used by the benchmarks.
+
+Serves one synthetic project with deterministic merge requests, notes,
+award emoji and commits, with GitLab's offset pagination headers, ETag
+revalidation, injected latency and injected 429 responses. Like GitLab, it
+refuses keyset pagination and unknown order_by values on these endpoints and
+leaves award emoji out of REST notes; REST clients list them per note. Requests are
+counted per route and exposed on /__stats.
+
+Run standalone with:
+    python benchmarks/fake_gitlab.py --port 8929 --config '{"merge_requests": 500}'
+"""
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from functools import lru_cache
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+PROJECT_ID = 1
+PROJECT_PATH = 'bench/project'
+
+# order_by values GitLab accepts on merge request listings that the fake can sort by
+MERGE_REQUEST_ORDER_BY = ('created_at', 'updated_at', 'merged_at', 'title')
+
+DEFAULT_CONFIG = {
+    'merge_requests': 500,
+    'notes': 10,
+    'commits': 3,
+    'emoji': 1,
+    'users': 25,
+    'max_per_page': 100,
+    'latency': 0.02,
+    'latency_jitter': 0.01,
+    'error_rate': 0.0,
+    'retry_after': 0.1,
+    'etags': True,
+    'spacing_hours': 1,
+    'seed': 42,
+}
+
+class FakeGitLab:
+    """
+    Synthetic GitLab project. Notes and commits are generated per merge request
+    from the seed, so every run serves identical data.
+    """
+
+    def __init__(self, config):
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.random = random.Random(self.config['seed'])
+        self.stats = Counter()
+        self.now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+        self.users = [f"user{i}" for i in range(self.config['users'])]
+        self.merge_requests = [self._merge_request(iid) for iid in range(1, self.config['merge_requests'] + 1)]
+        self.notes = lru_cache(maxsize=4096)(self._notes)
+        self.commits = lru_cache(maxsize=4096)(self._commits)
+
+    def _timestamp(self, value):
+        return value.isoformat().replace('+00:00', 'Z')
+
+    def _merge_request(self, iid):
+        rng = random.Random(self.config['seed'] * 1000003 + iid)
+        created = self.now - timedelta(hours=(self.config['merge_requests'] - iid) * self.config['spacing_hours'])
+        author = rng.choice(self.users)
+        return {
+            'id': 1000 + iid,
+            'iid': iid,
+            'project_id': PROJECT_ID,
+            'title': f"Merge request {iid}",
+            'description': 'Synthetic merge request. ' * 8,
+            'state': rng.choice(('opened', 'closed', 'merged')),
+            'created_at': self._timestamp(created),
+            'updated_at': self._timestamp(created + timedelta(minutes=30)),
+            'author': {'id': self.users.index(author), 'username': author, 'name': author.title()},
+            'web_url': f"https://gitlab.example.com/{PROJECT_PATH}/-/merge_requests/{iid}",
+        }
+
+    def _notes(self, iid):
+        rng = random.Random(self.config['seed'] * 7919 + iid)
+        created = datetime.fromisoformat(self.merge_requests[iid - 1]['created_at'].replace('Z', '+00:00'))
+        notes = []
+        for index in range(rng.randint(0, 2 * self.config['notes'])):
+            author = rng.choice(self.users)
+            notes.append({
+                'id': iid * 10000 + index,
+                'body': 'Looks good to me. ' * 4,
+                'system': False,
+                'created_at': self._timestamp(created + timedelta(minutes=index + 1)),
+                'author': {'id': self.users.index(author), 'username': author, 'name': author.title()},
+                'award_emoji': [
+                    {'id': index * 100 + position, 'name': 'thumbsup', 'user': {'username': rng.choice(self.users)}}
+                    for position in range(rng.randint(0, 2 * self.config['emoji']))
+                ],
+            })
+        return notes
+
+    def _commits(self, iid):
+        rng = random.Random(self.config['seed'] * 104729 + iid)
+        created = self.merge_requests[iid - 1]['created_at']
+        commits = []
+        for index in range(rng.randint(1, 2 * self.config['commits'] - 1) if self.config['commits'] else 0):
+            author = rng.choice(self.users)
+            commits.append({
+                'id': hashlib.sha1(f"{iid}-{index}".encode()).hexdigest(),
+                'title': f"Commit {index}",
+                'author_name': author,
+                'author_email': f"{author}@example.com",
+                'created_at': created,
+            })
+        return commits
+
+    def page(self, request, items, path):
+        """
+        Returns one page of items with offset pagination headers. Keyset pagination
+        is refused with a 405, as GitLab does for merge requests, notes and commits.
+        """
+        params = dict(request.query_params)
+        if params.get('pagination') == 'keyset':
+            self.stats['rejected'] += 1
+            return _error(405, 'Keyset pagination is not yet available for this type of request')
+        per_page = min(int(params.get('per_page', 20)), self.config['max_per_page'])
+        page = int(params.get('page', 1))
+        total_pages = max(1, -(-len(items) // per_page))
+        body = items[(page - 1) * per_page:page * per_page]
+        headers = {
+            'X-Total': str(len(items)),
+            'X-Total-Pages': str(total_pages),
+            'X-Page': str(page),
+            'X-Per-Page': str(per_page),
+            'X-Next-Page': str(page + 1) if page < total_pages else '',
+        }
+        if page < total_pages:
+            next_params = {**params, 'page': page + 1}
+            headers['Link'] = f'<{request.base_url}{path.lstrip("/")}?{urlencode(next_params)}>; rel="next"'
+        return self.json(request, body, headers)
+
+    def json(self, request, data, headers=None):
+        content = json.dumps(data).encode()
+        headers = dict(headers or {})
+        if self.config['etags']:
+            etag = f'W/"{hashlib.md5(content).hexdigest()}"'
+            headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                self.stats['not_modified'] += 1
+                return Response(status_code=304, headers={'ETag': etag})
+        self.stats['bytes'] += len(content)
+        return Response(content, media_type='application/json', headers=headers)
+
+    def list_merge_requests(self, request, path):
+        params = request.query_params
+        state = params.get('state', 'all')
+        items = [mr for mr in self.merge_requests if state == 'all' or mr['state'] == state]
+        for param, field in (('created_after', 'created_at'), ('updated_after', 'updated_at')):
+            if params.get(param):
+                bound = params[param].replace('Z', '+00:00')
+                items = [mr for mr in items if datetime.fromisoformat(mr[field].replace('Z', '+00:00')) > _aware(bound)]
+        order_by = params.get('order_by', 'created_at')
+        if order_by not in MERGE_REQUEST_ORDER_BY:
+            self.stats['rejected'] += 1
+            return _error(400, 'order_by does not have a valid value')
+        items.sort(key=lambda mr: (mr.get(order_by) or '', mr['id']), reverse=params.get('sort', 'desc') == 'desc')
+        return self.page(request, items, path)
+
+    def graphql(self, request, body):
+        variables = body.get('variables', {})
+        first = variables.get('first') or 100
+
+        def connection(items, after, convert):
+            start = int(after or 0)
+            return {
+                'pageInfo': {'hasNextPage': start + first < len(items), 'endCursor': str(start + first)},
+                'nodes': [convert(item) for item in items[start:start + first]],
+            }
+
+        def note(item):
+            return {
+                'id': f"gid://gitlab/Note/{item['id']}",
+                'system': item['system'],
+                'createdAt': item['created_at'],
+                'author': item['author'],
+                'awardEmoji': {'nodes': [{'name': emoji['name'], 'user': emoji['user']} for emoji in item['award_emoji']]},
+            }
+
+        def commit(item):
+            return {'sha': item['id'], 'authorName': item['author_name'], 'authorEmail': item['author_email'],
+                    'authoredDate': item['created_at']}
+
+        if 'iids' in variables:
+            nodes = [
+                {'iid': str(iid), 'notes': connection(self.notes(int(iid)), None, note),
+                 'commits': connection(self.commits(int(iid)), None, commit)}
+                for iid in variables['iids'] if 0 < int(iid) <= len(self.merge_requests)
+            ]
+            data = {'project': {'mergeRequests': {'nodes': nodes}}}
+        else:
+            iid = int(variables['iid'])
+            if 'notes(' in body['query']:
+                field = {'notes': connection(self.notes(iid), variables.get('after'), note)}
+            else:
+                field = {'commits': connection(self.commits(iid), variables.get('after'), commit)}
+            data = {'project': {'mergeRequest': field}}
+        return self.json(request, {'data': data})
+
+def _rest_note(note):
+    return {key: value for key, value in note.items() if key != 'award_emoji'}
+
+def _error(status_code, message):
+    return Response(json.dumps({'message': message}), status_code=status_code, media_type='application/json')
+
+def _aware(value):
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def create_app(config=None):
+    """
+    Creates the ASGI application serving a FakeGitLab
+    :param config: Optional overrides of DEFAULT_CONFIG
+    :return: FastAPI application
+    """
+    app = FastAPI()
+    gitlab = FakeGitLab(config or {})
+    app.state.gitlab = gitlab
+    project_details = {'id': PROJECT_ID, 'name': 'project', 'path_with_namespace': PROJECT_PATH,
+                       'web_url': f"https://gitlab.example.com/{PROJECT_PATH}"}
+
+    @app.get('/__stats')
+    async def stats():
+        return dict(gitlab.stats)
+
+    @app.post('/__reset')
+    async def reset():
+        gitlab.stats.clear()
+        return {}
+
+    @app.api_route('/api/{path:path}', methods=['GET', 'POST'])
+    async def api(request: Request, path: str):
+        config = gitlab.config
+        gitlab.stats['requests'] += 1
+        if config['latency'] or config['latency_jitter']:
+            await asyncio.sleep(config['latency'] + gitlab.random.uniform(0, config['latency_jitter']))
+        if config['error_rate'] and gitlab.random.random() < config['error_rate']:
+            gitlab.stats['throttled'] += 1
+            return Response(status_code=429, headers={'Retry-After': str(config['retry_after'])})
+
+        raw_path = request.scope.get('raw_path', b'').decode() or request.url.path
+        route = raw_path[len('/api'):]
+        if route == '/graphql' and request.method == 'POST':
+            gitlab.stats['graphql'] += 1
+            return gitlab.graphql(request, json.loads(await request.body()))
+        if route in (f'/v4/projects/{PROJECT_ID}', '/v4/projects/' + PROJECT_PATH.replace('/', '%2F')):
+            gitlab.stats['project'] += 1
+            return gitlab.json(request, project_details)
+        prefix = f'/v4/projects/{PROJECT_ID}/merge_requests'
+        if route == prefix:
+            gitlab.stats['merge_requests'] += 1
+            return gitlab.list_merge_requests(request, '/api' + route)
+        parts = route[len(prefix):].strip('/').split('/') if route.startswith(prefix + '/') else []
+        if len(parts) == 2 and parts[0].isdigit() and 0 < int(parts[0]) <= len(gitlab.merge_requests):
+            iid = int(parts[0])
+            if parts[1] == 'notes':
+                gitlab.stats['notes'] += 1
+                return gitlab.page(request, [_rest_note(note) for note in gitlab.notes(iid)], '/api' + route)
+            if parts[1] == 'commits':
+                gitlab.stats['commits'] += 1
+                return gitlab.page(request, gitlab.commits(iid), '/api' + route)
+        if (len(parts) == 4 and parts[0].isdigit() and 0 < int(parts[0]) <= len(gitlab.merge_requests)
+                and parts[1] == 'notes' and parts[3] == 'award_emoji'):
+            note = next((note for note in gitlab.notes(int(parts[0])) if str(note['id']) == parts[2]), None)
+            if note is not None:
+                gitlab.stats['award_emoji'] += 1
+                return gitlab.page(request, note['award_emoji'], '/api' + route)
+        if len(parts) == 1 and parts[0].isdigit() and 0 < int(parts[0]) <= len(gitlab.merge_requests):
+            gitlab.stats['merge_request'] += 1
+            return gitlab.json(request, gitlab.merge_requests[int(parts[0]) - 1])
+        gitlab.stats['not_found'] += 1
+        return _error(404, '404 Not Found')
+
+    return app
+
+if __name__ == '__main__':
+    import uvicorn
+    parser = argparse.ArgumentParser(description='Fake GitLab API for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8929)
+    parser.add_argument('--config', default='{}', help='JSON object overriding DEFAULT_CONFIG')
+    args = parser.parse_args()
+    uvicorn.run(create_app(json.loads(args.config)), host=args.host, port=args.port, log_level='warning')
@@ -0,0 +1,244 @@
+"""
+Offline benchmark of the scanner against the fake GitLab API.
+
+Starts benchmarks/fake_gitlab.py in a subprocess, points the scanner at it
+and runs each scenario end to end, reporting wall time, GitLab requests,
+requests per merge request, peak Python memory (tracemalloc) and
+throughput. Results are written as JSON; pass --baseline to compare with an
+earlier result and fail on regressions.
+
+Run from the backend directory:
+    python benchmarks/run.py --merge-requests 500 --latency 0.02 --output benchmarks/results/latest.json
+    python benchmarks/run.py --baseline benchmarks/baselines/default.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import urllib.request
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+REPOSITORY_URL = 'https://gitlab.example.com/bench/project'
+SCENARIOS = ('scan', 'participants', 'contributors', 'contributors_warm')
+# Metrics compared against a baseline; higher is worse for all of them
+COMPARED_METRICS = ('wall_time', 'requests', 'peak_memory')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the GitLab scanner against a local fake GitLab API')
+    parser.add_argument('--merge-requests', type=int, default=500, help='Number of merge requests in the fake project')
+    parser.add_argument('--notes', type=int, default=10, help='Average notes per merge request')
+    parser.add_argument('--commits', type=int, default=3, help='Average commits per merge request')
+    parser.add_argument('--emoji', type=int, default=1, help='Average award emoji per note')
+    parser.add_argument('--users', type=int, default=25, help='Number of distinct users')
+    parser.add_argument('--page-size', type=int, default=100, help='Maximum page size served by the fake API')
+    parser.add_argument('--latency', type=float, default=0.02, help='Added latency per request in seconds')
+    parser.add_argument('--latency-jitter', type=float, default=0.01, help='Random extra latency per request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 429')
+    parser.add_argument('--no-etags', action='store_true', help='Serve responses without ETags')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--backend', choices=('rest', 'graphql'), default='rest', help='Fetch backend for notes and commits')
+    parser.add_argument('--concurrency', type=int, default=None, help='Merge requests fetched concurrently')
+    parser.add_argument('--total', type=int, default=None, help='Merge requests requested by the scan scenarios, defaults to all')
+    parser.add_argument('--http-cache', action='store_true', help='Enable the on-disk HTTP cache')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenarios to run')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression before failing')
+    return parser.parse_args()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_fake_gitlab(config):
+    """
+    Starts the fake GitLab API in a subprocess so its memory and CPU use stay out of the measurements
+    :param config: Configuration passed to fake_gitlab.create_app
+    :return: Tuple of (subprocess.Popen, base URL)
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_gitlab.py'), '--port', str(port), '--config', json.dumps(config)],
+        cwd=BACKEND_DIR,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while True:
+        try:
+            urllib.request.urlopen(f'{base_url}/__stats', timeout=1)
+            return process, base_url
+        except OSError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                raise Exception('Fake GitLab API did not start')
+            time.sleep(0.1)
+
+def server_stats(base_url, reset=False):
+    if reset:
+        request = urllib.request.Request(f'{base_url}/__reset', method='POST')
+        urllib.request.urlopen(request).read()
+        return {}
+    return json.loads(urllib.request.urlopen(f'{base_url}/__stats').read())
+
+async def run_scenario(name, args, store_path):
+    """
+    Runs one scenario with a cold (or, for *_warm, the previous) store
+    :return: Tuple of (number of merge requests processed, number of items returned, scan stats)
+    """
+    import store
+    import gitlab_scanner
+    from gitlab_client import close_client
+
+    total = args.total or args.merge_requests
+    max_age = 365 * 10
+    store._store = store.MergeRequestStore(store_path)
+    try:
+        project_id = await gitlab_scanner.get_project_id(REPOSITORY_URL)
+        if name == 'scan':
+            merge_requests = await gitlab_scanner.scan_gitlab_repository(total, max_age, REPOSITORY_URL)
+            return len(merge_requests), len(merge_requests), {}
+        if name == 'participants':
+            merge_requests = await gitlab_scanner.get_merge_requests_with_participants(
+                project_id, total, max_age, REPOSITORY_URL, args.concurrency, args.backend
+            )
+            return len(merge_requests), len(merge_requests), {}
+        stats = {}
+        contributors, _ = await gitlab_scanner.get_all_contributors(
+            project_id, REPOSITORY_URL, args.concurrency, stats=stats, backend=args.backend
+        )
+        return stats['merge_requests'], len(contributors), stats
+    finally:
+        store._store.connection.close()
+        store._store = None
+        gitlab_scanner.project_cache.invalidate()
+        gitlab_scanner.count_cache.invalidate()
+        await close_client()
+
+def measure(name, args, base_url, store_path):
+    server_stats(base_url, reset=True)
+    tracemalloc.start()
+    start = time.perf_counter()
+    merge_requests, items, stats = asyncio.run(run_scenario(name, args, store_path))
+    wall_time = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    served = server_stats(base_url)
+    requests = served.get('requests', 0)
+    return {
+        'wall_time': wall_time,
+        'merge_requests': merge_requests,
+        'items': items,
+        'requests': requests,
+        'requests_per_mr': requests / merge_requests if merge_requests else 0.0,
+        'throttled': served.get('throttled', 0),
+        'not_modified': served.get('not_modified', 0),
+        'bytes_received': served.get('bytes', 0),
+        'peak_memory': peak_memory,
+        'throughput': merge_requests / wall_time if wall_time else 0.0,
+        'synced_merge_requests': stats.get('synced_merge_requests'),
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of each compared metric against the baseline
+    :return: List of regressions as (scenario, metric, baseline value, new value)
+    """
+    regressions = []
+    for scenario, metrics in results['results'].items():
+        previous = baseline.get('results', {}).get(scenario)
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flag = 'REGRESSION' if change > tolerance else ''
+            print(f"  {scenario:<18} {metric:<12} {old:>14.3f} -> {new:>14.3f} ({change:+.1%}) {flag}")
+            if change > tolerance:
+                regressions.append((scenario, metric, old, new))
+    return regressions
+
+def main():
+    args = parse_args()
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    config = {
+        'merge_requests': args.merge_requests,
+        'notes': args.notes,
+        'commits': args.commits,
+        'emoji': args.emoji,
+        'users': args.users,
+        'max_per_page': args.page_size,
+        'latency': args.latency,
+        'latency_jitter': args.latency_jitter,
+        'error_rate': args.error_rate,
+        'etags': not args.no_etags,
+        'seed': args.seed,
+    }
+    process, base_url = start_fake_gitlab(config)
+    workdir = tempfile.mkdtemp(prefix='gitlab-bench-')
+    # The scanner reads its settings at import time
+    os.environ.update({
+        'GITLAB_API_URL': f'{base_url}/api/v4',
+        'GITLAB_TOKEN': 'benchmark-token',
+        'GITLAB_HTTP2': 'false',
+        'GITLAB_HTTP_CACHE_DIR': os.path.join(workdir, 'http_cache'),
+        'GITLAB_HTTP_CACHE_SIZE': os.environ.get('GITLAB_HTTP_CACHE_SIZE', str(256 * 1024 * 1024)) if args.http_cache else '0',
+        'GITLAB_BACKOFF_BASE': os.environ.get('GITLAB_BACKOFF_BASE', '0.05'),
+    })
+    os.environ.setdefault('GITLAB_RATE_LIMIT', '1000')
+    os.environ.setdefault('GITLAB_RATE_BURST', '1000')
+    os.environ.setdefault('GITLAB_RATE_MAX', '1000')
+    sys.path.insert(0, BACKEND_DIR)
+    # Import before measuring so module loading doesn't count towards the first scenario
+    import gitlab_scanner  # noqa: F401
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {**config, 'backend': args.backend, 'concurrency': args.concurrency, 'total': args.total,
+                   'http_cache': args.http_cache},
+        'results': {},
+    }
+    try:
+        for scenario in scenarios:
+            # The warm run reuses the store of the cold contributor scan
+            store_name = 'contributors' if scenario == 'contributors_warm' else scenario
+            metrics = measure(scenario, args, base_url, os.path.join(workdir, f'{store_name}.db'))
+            results['results'][scenario] = metrics
+            print(f"{scenario:<18} {metrics['wall_time']:8.2f}s {metrics['requests']:6d} requests "
+                  f"{metrics['requests_per_mr']:6.2f}/MR {metrics['peak_memory'] / 1e6:8.1f} MB peak "
+                  f"{metrics['throughput']:8.1f} MR/s")
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"Compared with {args.baseline}:")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire after a fixed time to live
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key, counting the lookup as a hit or miss
+        :param key: Cache key
+        :param default: Value returned when the key is missing or expired
+        :return: Cached value or default
+        """
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING:
+            value, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry when full
+        :param key: Cache key
+        :param value: Value to cache
+        """
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """
+        Removes entries from the cache
+        :param predicate: Optional function of the key; only matching entries are removed
+        :return: Number of removed entries
+        """
+        if predicate is None:
+            removed = len(self._entries)
+            self._entries.clear()
+        else:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            removed = len(keys)
+        logger.info(f"Invalidated {removed} entries from the {self.name} cache")
+        return removed
+
+    def stats(self):
+        """
+        Returns hit/miss counters and occupancy of the cache
+        :return: Dictionary of cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,36 @@
+import os
+import asyncio
+import logging
+
+GITLAB_MR_CONCURRENCY = int(os.environ.get('GITLAB_MR_CONCURRENCY', 8))
+
+logger = logging.getLogger(__name__)
+
+async def gather_bounded(items, worker, concurrency=None, on_result=None):
+    """
+    Runs worker(item) for every item with at most `concurrency` calls in flight
+    :param items: Sequence of items to process
+    :param worker: Coroutine function called with each item
+    :param concurrency: Maximum number of concurrent calls, defaults to GITLAB_MR_CONCURRENCY
+    :param on_result: Optional function called with (index, result) as each call completes
+    :return: List of results in the same order as items. If a call raised, the
+             exception is returned in its slot instead of aborting the batch.
+    """
+    concurrency = max(1, concurrency or GITLAB_MR_CONCURRENCY)
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+
+    async def drain():
+        for index, item in pending:
+            try:
+                results[index] = await worker(item)
+            except Exception as error:
+                results[index] = error
+            if on_result is not None:
+                on_result(index, results[index])
+
+    await asyncio.gather(*(drain() for _ in range(min(concurrency, len(items)))))
+    failures = sum(1 for result in results if isinstance(result, Exception))
+    if failures:
+        logger.warning(f"{failures} of {len(items)} tasks failed")
+    return results
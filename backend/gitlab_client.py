@@ -0,0 +1,291 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+import httpx
+from concurrency import gather_bounded
+from rate_limiter import GITLAB_MAX_RETRIES, get_limiter, retry_after, backoff_delay, is_retryable
+from http_cache import HTTPCache, get_http_cache
+from metrics import Counter, Histogram, span
+from aggregation import loads
+
+GITLAB_API_URL = os.environ.get('GITLAB_API_URL', 'https://gitlab.com/api/v4')
+GITLAB_TOKEN = os.environ.get('GITLAB_TOKEN')
+GITLAB_GRAPHQL_URL = os.environ.get('GITLAB_GRAPHQL_URL', GITLAB_API_URL.rstrip('/').rsplit('/v4', 1)[0] + '/graphql')
+GITLAB_HTTP2 = os.environ.get('GITLAB_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+GITLAB_MAX_CONNECTIONS = int(os.environ.get('GITLAB_MAX_CONNECTIONS', 20))
+GITLAB_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('GITLAB_MAX_KEEPALIVE_CONNECTIONS', 10))
+GITLAB_KEEPALIVE_EXPIRY = float(os.environ.get('GITLAB_KEEPALIVE_EXPIRY', 30))
+GITLAB_TIMEOUT = float(os.environ.get('GITLAB_TIMEOUT', 30))
+GITLAB_MAX_PER_HOST = int(os.environ.get('GITLAB_MAX_PER_HOST', 10))
+GITLAB_PER_PAGE = int(os.environ.get('GITLAB_PER_PAGE', 100))
+GITLAB_PAGE_CONCURRENCY = int(os.environ.get('GITLAB_PAGE_CONCURRENCY', 4))
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_host_semaphores = {}
+_request_counter = contextvars.ContextVar('gitlab_request_counter', default=None)
+
+GITLAB_REQUESTS = Counter('gitlab_scanner_gitlab_requests_total', 'GitLab API requests sent, including retries', ('method', 'route', 'status'))
+GITLAB_REQUEST_DURATION = Histogram('gitlab_scanner_gitlab_request_duration_seconds', 'Latency of GitLab API requests', ('method', 'route'))
+GITLAB_THROTTLE_WAIT = Histogram('gitlab_scanner_gitlab_throttle_wait_seconds', 'Time GitLab API requests waited for the rate limiter', ('route',))
+GITLAB_RETRIES = Counter('gitlab_scanner_gitlab_retries_total', 'GitLab API requests retried', ('route', 'reason'))
+GITLAB_SENT_BYTES = Counter('gitlab_scanner_gitlab_request_bytes_total', 'Bytes sent in GitLab API request bodies', ('route',))
+GITLAB_RECEIVED_BYTES = Counter('gitlab_scanner_gitlab_response_bytes_total', 'Bytes received in GitLab API response bodies', ('route',))
+GITLAB_JSON_PARSE_DURATION = Histogram('gitlab_scanner_gitlab_json_parse_seconds', 'Time spent parsing GitLab API responses', ('route',),
+                                       buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+
+def _http2_available():
+    """
+    Checks whether the optional h2 package needed for HTTP/2 is installed
+    :return: True if HTTP/2 can be negotiated
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def get_client():
+    """
+    Returns the shared GitLab API client, creating it on first use.
+    The client keeps connections alive between calls so scans don't pay a
+    TCP and TLS handshake per request.
+    :return: httpx.AsyncClient bound to GITLAB_API_URL
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = GITLAB_HTTP2 and _http2_available()
+        headers = {'PRIVATE-TOKEN': GITLAB_TOKEN} if GITLAB_TOKEN else {}
+        _client = httpx.AsyncClient(
+            base_url=GITLAB_API_URL,
+            headers=headers,
+            http2=http2,
+            timeout=GITLAB_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=GITLAB_MAX_CONNECTIONS,
+                max_keepalive_connections=GITLAB_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=GITLAB_KEEPALIVE_EXPIRY,
+            ),
+        )
+        logger.info(f"Created GitLab client for {GITLAB_API_URL} (http2={http2}, max_connections={GITLAB_MAX_CONNECTIONS})")
+    return _client
+
+async def close_client():
+    """
+    Closes the shared GitLab API client and its pooled connections
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Closed GitLab client")
+    _host_semaphores.clear()
+
+async def gitlab_get(path, params=None):
+    """
+    Performs a GET request against the GitLab API using the shared client.
+    At most GITLAB_MAX_PER_HOST requests are in flight per GitLab host, and all
+    requests made with the same token share one rate limiter. 429 and 5xx
+    responses and connection errors are retried with jittered exponential
+    backoff, up to GITLAB_MAX_RETRIES times. Responses are kept in the HTTP
+    cache and revalidated with If-None-Match/If-Modified-Since, so unchanged
+    resources come back as a 304 without a body.
+    :param path: API path relative to GITLAB_API_URL, e.g. '/projects/1'
+    :param params: Optional query parameters
+    :return: httpx.Response
+    :raises: httpx.HTTPError if the request fails or returns an error status
+    """
+    return await _send('GET', path, params=params)
+
+async def gitlab_graphql(query, variables=None):
+    """
+    Runs a query against the GitLab GraphQL API, with the same limits and retries as gitlab_get
+    :param query: GraphQL query document
+    :param variables: Optional query variables
+    :return: The 'data' member of the response
+    :raises: Exception if GitLab reports GraphQL errors, httpx.HTTPError if the request fails
+    """
+    response = await _send('POST', GITLAB_GRAPHQL_URL, json={'query': query, 'variables': variables or {}})
+    payload = parse_json(response)
+    if payload.get('errors'):
+        messages = '; '.join(error.get('message', str(error)) for error in payload['errors'])
+        logger.error(f"GitLab GraphQL error: {messages}")
+        raise Exception(f'GraphQL error: {messages}')
+    return payload['data']
+
+async def _send(method, url, **kwargs):
+    client = get_client()
+    request = client.build_request(method, url, **kwargs)
+    route = route_template(request.url)
+    with span(f"{method} {route}"):
+        return await _send_request(client, request, route)
+
+async def _send_request(client, request, route):
+    method, url = request.method, request.url
+    cache = get_http_cache() if method == 'GET' else None
+    cache_key = HTTPCache.key(request, GITLAB_TOKEN) if cache is not None else None
+    if cache_key is None:
+        cache = None
+    cached = None
+    if cache is not None:
+        cached = await cache.lookup(cache_key)
+        if cached is not None and cached.fresh:
+            cache.hits += 1
+            return cached.to_response(request)
+        if cached is not None:
+            request.headers.update(cached.validators())
+
+    host = client.base_url.host
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(GITLAB_MAX_PER_HOST)
+    limiter = get_limiter(GITLAB_TOKEN)
+    counter = _request_counter.get()
+
+    for attempt in range(GITLAB_MAX_RETRIES + 1):
+        with GITLAB_THROTTLE_WAIT.time(route=route):
+            await limiter.acquire()
+        if counter is not None:
+            counter['requests'] += 1
+        start = time.perf_counter()
+        try:
+            async with _host_semaphores[host]:
+                response = await client.send(request)
+        except httpx.TransportError as error:
+            GITLAB_REQUESTS.inc(method=method, route=route, status='error')
+            if attempt == GITLAB_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            reason = type(error).__name__
+            logger.warning(f"GitLab request to {url} failed ({error!r}), retrying in {delay:.1f}s")
+        else:
+            GITLAB_REQUEST_DURATION.observe(time.perf_counter() - start, method=method, route=route)
+            GITLAB_REQUESTS.inc(method=method, route=route, status=response.status_code)
+            GITLAB_SENT_BYTES.inc(len(request.content), route=route)
+            GITLAB_RECEIVED_BYTES.inc(len(response.content), route=route)
+            limiter.observe(response)
+            if not is_retryable(response) or attempt == GITLAB_MAX_RETRIES:
+                break
+            delay = retry_after(response) or backoff_delay(attempt)
+            reason = response.status_code
+            logger.warning(f"GitLab returned {response.status_code} for {url}, retrying in {delay:.1f}s")
+        GITLAB_RETRIES.inc(route=route, reason=reason)
+        limiter.retries += 1
+        await asyncio.sleep(delay)
+
+    if cached is not None and response.status_code == 304:
+        await cache.revalidate(cached, response)
+        return cached.to_response(request)
+    if cache is not None:
+        await cache.store(cache_key, response)
+    response.raise_for_status()
+    return response
+
+def route_template(url):
+    """
+    Reduces a GitLab API URL to its route, replacing IDs and paths with placeholders
+    so that metrics are aggregated per endpoint rather than per resource
+    :param url: httpx.URL of the request
+    :return: Route such as '/projects/:id/merge_requests/:iid/notes'
+    """
+    path = url.raw_path.decode().split('?', 1)[0]
+    base_path = get_client().base_url.raw_path.decode().rstrip('/')
+    if path.startswith(base_path + '/'):
+        path = path[len(base_path):]
+    segments = path.strip('/').split('/')
+    for index, segment in enumerate(segments):
+        previous = segments[index - 1] if index else None
+        if previous in ('projects', 'groups', 'users'):
+            segments[index] = ':id'
+        elif previous == 'merge_requests' and segment.isdigit():
+            segments[index] = ':iid'
+        elif segment.isdigit() or re.fullmatch(r'[0-9a-f]{40}', segment):
+            segments[index] = ':id'
+    return '/' + '/'.join(segments)
+
+def parse_json(response):
+    """
+    Decodes a GitLab API response with orjson when available, recording the time spent
+    :param response: httpx.Response
+    :return: Decoded JSON
+    """
+    with GITLAB_JSON_PARSE_DURATION.time(route=route_template(response.request.url)):
+        return loads(response.content)
+
+async def paginate(path, params=None, page_concurrency=None, on_response=None):
+    """
+    Iterates over the pages of a paginated GitLab API endpoint with offset
+    pagination, following the Link header or X-Next-Page. When
+    X-Total-Pages is known, the following pages are fetched concurrently in
+    windows of page_concurrency. Stop iterating to stop requesting pages.
+    :param path: API path relative to GITLAB_API_URL
+    :param params: Optional query parameters
+    :param page_concurrency: Maximum number of pages fetched at once, defaults to GITLAB_PAGE_CONCURRENCY
+    :param on_response: Optional function called with the httpx.Response of the first page, e.g. to read X-Total
+    :return: Async generator of pages (lists of items)
+    """
+    params = dict(params or {})
+    params.setdefault('per_page', GITLAB_PER_PAGE)
+    if page_concurrency is None:
+        page_concurrency = GITLAB_PAGE_CONCURRENCY
+    page_concurrency = max(1, page_concurrency)
+
+    response = await gitlab_get(path, params=params)
+    if on_response is not None:
+        on_response(response)
+    yield parse_json(response)
+    while True:
+        next_page = response.headers.get('X-Next-Page')
+        total_pages = response.headers.get('X-Total-Pages')
+        next_link = response.links.get('next', {}).get('url')
+        if next_page and total_pages and page_concurrency > 1:
+            pages = list(range(int(next_page), min(int(total_pages), int(next_page) + page_concurrency - 1) + 1))
+            responses = await gather_bounded(
+                pages,
+                lambda page: gitlab_get(path, params={**params, 'page': page}),
+                page_concurrency
+            )
+            for page_response in responses:
+                if isinstance(page_response, Exception):
+                    raise page_response
+            for page_response in responses:
+                yield parse_json(page_response)
+            response = responses[-1]
+        elif next_link:
+            response = await gitlab_get(next_link)
+            yield parse_json(response)
+        elif next_page:
+            params['page'] = int(next_page)
+            response = await gitlab_get(path, params=params)
+            yield parse_json(response)
+        else:
+            return
+
+async def gitlab_get_all(path, params=None):
+    """
+    Fetches every item of a paginated GitLab API endpoint
+    :param path: API path relative to GITLAB_API_URL
+    :param params: Optional query parameters
+    :return: List of items from all pages
+    """
+    items = []
+    async for page in paginate(path, params):
+        items.extend(page)
+    return items
+
+@contextmanager
+def count_requests():
+    """
+    Counts the GitLab API requests made by the current task and the tasks it spawns
+    :return: Context manager yielding a dictionary with a 'requests' count
+    """
+    counter = {'requests': 0}
+    token = _request_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _request_counter.reset(token)
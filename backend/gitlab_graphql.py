@@ -0,0 +1,141 @@
+import os
+import logging
+from gitlab_client import gitlab_graphql
+
+GITLAB_GRAPHQL_BATCH_SIZE = int(os.environ.get('GITLAB_GRAPHQL_BATCH_SIZE', 20))
+GITLAB_GRAPHQL_PAGE_SIZE = int(os.environ.get('GITLAB_GRAPHQL_PAGE_SIZE', 100))
+
+logger = logging.getLogger(__name__)
+
+NOTE_FIELDS = """
+    pageInfo { hasNextPage endCursor }
+    nodes {
+        id
+        system
+        createdAt
+        author { username name }
+        awardEmoji { nodes { name user { username } } }
+    }
+"""
+
+COMMIT_FIELDS = """
+    pageInfo { hasNextPage endCursor }
+    nodes {
+        sha
+        authorName
+        authorEmail
+        authoredDate
+    }
+"""
+
+BATCH_QUERY = """
+query($fullPath: ID!, $iids: [String!], $first: Int) {
+    project(fullPath: $fullPath) {
+        mergeRequests(iids: $iids, first: $first) {
+            nodes {
+                iid
+                notes(first: $first) { %s }
+                commits(first: $first) { %s }
+            }
+        }
+    }
+}
+""" % (NOTE_FIELDS, COMMIT_FIELDS)
+
+NOTES_PAGE_QUERY = """
+query($fullPath: ID!, $iid: String!, $first: Int, $after: String) {
+    project(fullPath: $fullPath) {
+        mergeRequest(iid: $iid) {
+            notes(first: $first, after: $after) { %s }
+        }
+    }
+}
+""" % NOTE_FIELDS
+
+COMMITS_PAGE_QUERY = """
+query($fullPath: ID!, $iid: String!, $first: Int, $after: String) {
+    project(fullPath: $fullPath) {
+        mergeRequest(iid: $iid) {
+            commits(first: $first, after: $after) { %s }
+        }
+    }
+}
+""" % COMMIT_FIELDS
+
+async def fetch_merge_request_activity(full_path, mr_iids):
+    """
+    Fetches notes (with award emoji) and commits for a batch of merge requests in
+    one GraphQL query, following cursors for merge requests with more than one page
+    :param full_path: Full path of the GitLab project, e.g. 'group/project'
+    :param mr_iids: List of merge request IIDs, at most GITLAB_GRAPHQL_BATCH_SIZE
+    :return: Dictionary of iid -> (notes, commits) in the REST API shape
+    """
+    logger.info(f"Fetching activity for {len(mr_iids)} merge requests of {full_path} via GraphQL")
+    data = await gitlab_graphql(BATCH_QUERY, {
+        'fullPath': full_path,
+        'iids': [str(iid) for iid in mr_iids],
+        'first': GITLAB_GRAPHQL_PAGE_SIZE,
+    })
+    project = data.get('project')
+    if project is None:
+        raise Exception('Project not found. Please check your repository URL.')
+
+    activity = {}
+    for node in project['mergeRequests']['nodes']:
+        iid = int(node['iid'])
+        notes = await _remaining_nodes(full_path, iid, node['notes'], 'notes', NOTES_PAGE_QUERY)
+        commits = await _remaining_nodes(full_path, iid, node['commits'], 'commits', COMMITS_PAGE_QUERY)
+        activity[iid] = ([_note(note) for note in notes], [_commit(commit) for commit in commits])
+    return activity
+
+async def _remaining_nodes(full_path, iid, connection, field, query):
+    """
+    Collects all nodes of a connection, requesting further pages by cursor
+    :return: List of nodes
+    """
+    nodes = list(connection['nodes'])
+    page_info = connection['pageInfo']
+    while page_info['hasNextPage']:
+        data = await gitlab_graphql(query, {
+            'fullPath': full_path,
+            'iid': str(iid),
+            'first': GITLAB_GRAPHQL_PAGE_SIZE,
+            'after': page_info['endCursor'],
+        })
+        page = data['project']['mergeRequest'][field]
+        nodes.extend(page['nodes'])
+        page_info = page['pageInfo']
+    return nodes
+
+def _global_id(gid):
+    """
+    Extracts the numeric ID from a GraphQL global ID such as 'gid://gitlab/Note/123'
+    """
+    return int(str(gid).rsplit('/', 1)[-1])
+
+def _note(node):
+    """
+    Converts a GraphQL note to the REST note shape used by the store and aggregation
+    """
+    return {
+        'id': _global_id(node['id']),
+        'system': node.get('system', False),
+        'created_at': node['createdAt'],
+        'author': {'username': node['author']['username'], 'name': node['author'].get('name')},
+        'award_emoji': [
+            # GraphQL award emoji carry no ID; the store keys them by note, user and name
+            {'id': None, 'name': emoji['name'], 'user': {'username': emoji['user']['username']}}
+            for emoji in node.get('awardEmoji', {}).get('nodes', [])
+        ],
+    }
+
+def _commit(node):
+    """
+    Converts a GraphQL commit to the REST commit shape used by the store and aggregation
+    """
+    return {
+        'id': node['sha'],
+        'author_name': node['authorName'],
+        'author_email': node.get('authorEmail'),
+        'created_at': node.get('authoredDate'),
+    }
@@ -1,15 +1,46 @@
 import os
-import requests
+import httpx
 import logging
-from urllib.parse import urlparse
+from contextlib import contextmanager
+from urllib.parse import urlparse, quote
+from email.utils import parsedate_to_datetime
+from gitlab_client import GITLAB_TOKEN, GITLAB_PER_PAGE, gitlab_get, gitlab_get_all, paginate, count_requests
+from concurrency import GITLAB_MR_CONCURRENCY, gather_bounded
+from store import get_store
+from cache import TTLCache
+from aggregation import loads, add_merge_request_activity, merge_contributors, tally_merge_requests, tally_in_pool
+from gitlab_graphql import GITLAB_GRAPHQL_BATCH_SIZE, fetch_merge_request_activity
+from http_cache import get_http_cache
+from records import MergeRequestRecord
+from metrics import Gauge, Histogram, span
 
-GITLAB_API_URL = os.environ.get('GITLAB_API_URL', 'https://gitlab.com/api/v4')
-GITLAB_TOKEN = os.environ.get('GITLAB_TOKEN')
 REPOSITORY_URL = os.environ.get('REPOSITORY_URL')
+GITLAB_CACHE_TTL = float(os.environ.get('GITLAB_CACHE_TTL', 300))
+GITLAB_CACHE_SIZE = int(os.environ.get('GITLAB_CACHE_SIZE', 256))
+# 'rest' fetches notes and commits per merge request, 'graphql' fetches them for a batch of merge requests per query
+GITLAB_FETCH_BACKEND = os.environ.get('GITLAB_FETCH_BACKEND', 'rest')
+FETCH_BACKENDS = ('rest', 'graphql')
+MEMBERS_FILE = os.environ.get('MEMBERS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'members.txt'))
+GITLAB_PROJECT_CONCURRENCY = int(os.environ.get('GITLAB_PROJECT_CONCURRENCY', 4))
+
+# Keyed by (repository_url, token) and (repository_url, token, state) respectively
+project_cache = TTLCache('project', GITLAB_CACHE_SIZE, GITLAB_CACHE_TTL)
+count_cache = TTLCache('count', GITLAB_CACHE_SIZE, GITLAB_CACHE_TTL)
+
+SCANS_IN_PROGRESS = Gauge('gitlab_scanner_scans_in_progress', 'Contributor scans currently running', ('scope',))
+SCAN_PHASE_DURATION = Histogram('gitlab_scanner_scan_phase_seconds', 'Time spent in each phase of a scan', ('phase',))
 
 logger = logging.getLogger(__name__)
 
-def get_project_id(repository_url):
+@contextmanager
+def _phase(name):
+    """
+    Times a scan phase in the phase histogram and in the request trace
+    """
+    with span(name), SCAN_PHASE_DURATION.time(phase=name):
+        yield
+
+async def get_project_id(repository_url):
     """
     Determines the PROJECT_ID based on the repository_url
     :param repository_url: URL of the GitLab repository
@@ -17,7 +48,7 @@ def get_project_id(repository_url):
     :raises: Exception if there's an error fetching project details
     """
     logger.info(f"Attempting to get project ID for repository: {repository_url}")
-    return _get_project_details(repository_url)['id']
+    return (await _get_project_details(repository_url))['id']
 
 def get_repo_url():
     """
@@ -36,7 +67,7 @@ def set_repo_url(new_repo_url):
     REPOSITORY_URL = new_repo_url
     logger.info(f"Set new repository URL: {REPOSITORY_URL}")
 
-def _get_project_details(repository_url):
+async def _get_project_details(repository_url):
     """
     Fetches project details from GitLab API
     :param repository_url: URL of the GitLab repository
@@ -47,21 +78,23 @@ def _get_project_details(repository_url):
         logger.error("repository_url is not set")
         raise Exception('repository_url is not set')
 
+    cache_key = (repository_url, GITLAB_TOKEN)
+    project_details = project_cache.get(cache_key)
+    if project_details is not None:
+        return project_details
+
     parsed_url = urlparse(repository_url)
     path = parsed_url.path.strip('/')
-    encoded_path = requests.utils.quote(path, safe='')
+    encoded_path = quote(path, safe='')
 
     try:
-        response = requests.get(
-            f'{GITLAB_API_URL}/projects/{encoded_path}',
-            headers={'PRIVATE-TOKEN': GITLAB_TOKEN}
-        )
-        response.raise_for_status()
+        response = await gitlab_get(f'/projects/{encoded_path}')
         project_details = response.json()
+        project_cache.set(cache_key, project_details)
         logger.info(f"Successfully retrieved project details for: {project_details['name']}")
         return project_details
-    except requests.exceptions.RequestException as error:
-        if error.response:
+    except httpx.HTTPError as error:
+        if isinstance(error, httpx.HTTPStatusError):
             if error.response.status_code == 401:
                 logger.error("Unauthorized. Please check your GitLab token.")
                 raise Exception('Unauthorized. Please check your GitLab token.')
@@ -71,74 +104,391 @@ def _get_project_details(repository_url):
         logger.error(f"Error getting project details: {str(error)}")
         raise
 
+async def get_project_path(project_id):
+    """
+    Returns the full path of a project, as needed by the GraphQL API
+    :param project_id: ID of the GitLab project
+    :return: Full path such as 'group/project'
+    """
+    cache_key = (project_id, GITLAB_TOKEN)
+    project_details = project_cache.get(cache_key)
+    if project_details is None:
+        response = await gitlab_get(f'/projects/{project_id}')
+        project_details = response.json()
+        project_cache.set(cache_key, project_details)
+    return project_details['path_with_namespace']
+
 from datetime import datetime, timedelta
 
-def scan_gitlab_repository(total, max_age, repository_url):
+MERGE_REQUEST_STATES = ('opened', 'closed', 'merged')
+PARTICIPANTS_BATCH_SIZE = int(os.environ.get('PARTICIPANTS_BATCH_SIZE', 50))
+
+async def scan_gitlab_repository(total, max_age, repository_url, fields=None):
     """
     Scans the GitLab repository for merge requests
     :param total: Maximum number of merge requests to fetch
     :param max_age: Maximum age of merge requests in days
     :param repository_url: URL of the GitLab repository
+    :param fields: Optional tuple of fields; merge requests are then returned as slim MergeRequestRecords
     :return: List of merge requests
     :raises: Exception if there's an error fetching merge requests
     """
+    all_mrs = [mr async for mr in iter_gitlab_repository(total, max_age, repository_url, fields)]
+    logger.info(f"Scan complete. Retrieved {len(all_mrs)} merge requests")
+    return all_mrs
+
+async def iter_gitlab_repository(total, max_age, repository_url, fields=None):
+    """
+    Streams the newest merge requests of the GitLab repository across all states.
+    Once the project has been synced into the store the merge requests are read
+    from there after an incremental sync; otherwise the opened, closed and merged
+    listings are streamed from the API and merged, requesting no more pages than
+    `total` needs.
+    :param total: Maximum number of merge requests to yield
+    :param max_age: Maximum age of merge requests in days
+    :param repository_url: URL of the GitLab repository
+    :param fields: Optional tuple of fields; merge requests are then yielded as slim MergeRequestRecords
+    :return: Async generator of merge requests, newest first
+    :raises: Exception if there's an error fetching merge requests
+    """
     logger.info(f"Starting GitLab repository scan for {total} MRs with max age of {max_age} days")
     if not GITLAB_TOKEN:
         logger.error("GITLAB_TOKEN is not set")
         raise Exception('GITLAB_TOKEN is not set')
 
     try:
-        project_id = get_project_id(repository_url)
-        open_mrs = fetch_merge_requests('opened', project_id, total, max_age, repository_url)
-        closed_mrs = fetch_merge_requests('closed', project_id, total, max_age, repository_url)
-        all_mrs = open_mrs + closed_mrs
-        all_mrs.sort(key=lambda x: x['created_at'], reverse=True)
-        total_mrs = min(len(all_mrs), total)
-        logger.info(f"Scan complete. Retrieved {total_mrs} merge requests")
-        return all_mrs[:total_mrs]
+        project_id = await get_project_id(repository_url)
+        store = get_store()
+        if await store.run(store.get_watermark, project_id):
+            await sync_merge_requests(project_id)
+            oldest_date = datetime.utcnow() - timedelta(days=max_age)
+            batches = store.iter_merge_request_batches(project_id, MERGE_REQUEST_STATES, oldest_date.isoformat(), total)
+            try:
+                while True:
+                    batch = await store.run(next, batches, None)
+                    if batch is None:
+                        return
+                    for mr in batch:
+                        yield MergeRequestRecord(mr, fields) if fields else mr
+            finally:
+                await store.run(batches.close)
+
+        async def store_page(page_mrs):
+            await store.run(store.upsert_merge_requests, project_id, page_mrs)
+
+        # Each stream may end up supplying every merge request, but together they need no more
+        # pages than `total` fills, so the pages beyond the first ones are shared among the streams
+        pages = -(-total // max(1, min(total, GITLAB_PER_PAGE)))
+        page_concurrency = max(1, -(-(pages - 1) // len(MERGE_REQUEST_STATES)))
+        streams = [
+            iter_merge_requests(state, project_id, max_age, total, on_page=store_page, page_concurrency=page_concurrency)
+            for state in MERGE_REQUEST_STATES
+        ]
+        count = 0
+        async for mr in _merge_newest_first(streams):
+            yield MergeRequestRecord(mr, fields) if fields else mr
+            count += 1
+            if count >= total:
+                break
     except Exception as error:
         logger.error(f'Error scanning GitLab repository: {error}')
         raise
 
-def fetch_merge_requests(state, project_id, limit, max_age, repository_url):
+async def _merge_newest_first(streams):
+    """
+    Merges merge request streams that are each sorted newest first (by created_at) into one
+    :param streams: List of async generators of merge requests
+    :return: Async generator of merge requests, newest first
+    """
+    heads = {}
+    try:
+        for index in range(len(streams)):
+            await _advance(streams, heads, index)
+        while heads:
+            index = max(heads, key=lambda i: (heads[i]['created_at'], heads[i]['id']))
+            yield heads.pop(index)
+            await _advance(streams, heads, index)
+    finally:
+        for stream in streams:
+            await stream.aclose()
+
+async def _advance(streams, heads, index):
+    try:
+        heads[index] = await streams[index].__anext__()
+    except StopAsyncIteration:
+        pass
+
+async def sync_merge_requests(project_id):
+    """
+    Pulls merge requests updated since the last sync into the local store.
+    The listing is ordered by created_at, which updates don't change, so an
+    update during the crawl adds a merge request to the listing rather than
+    shifting the later pages. The watermark only advances once the crawl saw
+    at least the X-Total merge requests GitLab announced, and never past the
+    time the crawl started, so merge requests updated meanwhile are listed
+    again by the next sync.
+    :param project_id: ID of the GitLab project
+    :return: Number of merge requests inserted or updated
+    :raises: Exception if there's an error fetching merge requests
+    """
+    store = get_store()
+    watermark = await store.run(store.get_watermark, project_id)
+    logger.info(f"Syncing merge requests for project ID {project_id} updated after {watermark or 'the beginning'}")
+    params = {'state': 'all', 'order_by': 'created_at', 'sort': 'asc'}
+    if watermark:
+        params['updated_after'] = watermark
+    seen = set()
+    newest = watermark
+    first_page = {}
+
+    def on_response(response):
+        first_page['total'] = response.headers.get('X-Total')
+        first_page['date'] = response.headers.get('Date')
+
+    try:
+        async for page_mrs in paginate(f'/projects/{project_id}/merge_requests', params, on_response=on_response):
+            if not page_mrs:
+                break
+            await store.run(store.upsert_merge_requests, project_id, page_mrs)
+            newest = max([newest or '', *(mr['updated_at'] for mr in page_mrs)])
+            seen.update(mr['iid'] for mr in page_mrs)
+        synced = len(seen)
+
+        # GitLab leaves X-Total out above 10,000 merge requests
+        expected = int(first_page['total']) if first_page.get('total') else None
+        if expected is not None and synced < expected:
+            logger.warning(f"Listed {synced} of {expected} merge requests for project ID {project_id}, "
+                           f"keeping the watermark at {watermark}")
+        elif newest:
+            crawl_start = _http_date(first_page.get('date'))
+            await store.run(store.set_watermark, project_id, min(newest, crawl_start) if crawl_start else newest)
+
+        logger.info(f"Synced {synced} merge requests for project ID {project_id}")
+        return synced
+    except httpx.HTTPError as error:
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code == 401:
+                logger.error("Unauthorized. Please check your GitLab token.")
+                raise Exception('Unauthorized. Please check your GitLab token.')
+            elif error.response.status_code == 404:
+                logger.error("Project not found. Please check your repository URL.")
+                raise Exception('Project not found. Please check your repository URL.')
+        logger.error(f"Error syncing merge requests: {str(error)}")
+        raise
+
+def _http_date(value):
+    """
+    Converts an HTTP Date header to the timestamp format of the GitLab API
+    :param value: Header value such as 'Sat, 17 Oct 2026 19:00:00 GMT', or None
+    :return: Timestamp such as '2026-10-17T19:00:00.000Z', or None if the header is missing or malformed
+    """
+    try:
+        return parsedate_to_datetime(value).strftime('%Y-%m-%dT%H:%M:%S.000Z') if value else None
+    except (TypeError, ValueError):
+        return None
+
+async def sync_merge_request_activity(project_id, mr_iids=None, concurrency=None, on_synced=None, backend=None):
+    """
+    Fetches notes and commits for merge requests that changed since they were last stored
+    :param project_id: ID of the GitLab project
+    :param mr_iids: Optional list of IIDs to restrict the sync to
+    :param concurrency: Maximum number of merge requests (or GraphQL batches) fetched concurrently
+    :param on_synced: Optional function called with (iid, (notes, commits) or exception) as each merge request completes
+    :param backend: 'rest' or 'graphql', defaults to GITLAB_FETCH_BACKEND
+    :return: Dictionary of iid -> error for merge requests that could not be synced
+    """
+    backend = _fetch_backend(backend)
+    store = get_store()
+    stale = await store.run(store.stale_merge_requests, project_id, mr_iids)
+    logger.info(f"Syncing activity for {len(stale)} merge requests in project ID {project_id} via {backend}")
+    failures = {}
+
+    if backend == 'graphql':
+        await _sync_merge_request_activity_graphql(project_id, stale, concurrency, on_synced, failures)
+        return failures
+
+    async def fetch_activity(item):
+        iid, updated_at = item
+        notes = await fetch_merge_request_notes(project_id, iid)
+        commits = await fetch_merge_request_commits(project_id, iid)
+        await store.run(store.replace_activity, project_id, iid, updated_at, notes, commits)
+        return notes, commits
+
+    def record_activity(index, result):
+        iid, _ = stale[index]
+        if isinstance(result, Exception):
+            failures[iid] = result
+        if on_synced is not None:
+            on_synced(iid, result)
+
+    await gather_bounded(stale, fetch_activity, concurrency, on_result=record_activity)
+    return failures
+
+async def _sync_merge_request_activity_graphql(project_id, stale, concurrency, on_synced, failures):
+    """
+    Fetches notes and commits of stale merge requests in batches of
+    GITLAB_GRAPHQL_BATCH_SIZE, one GraphQL query per batch. A failed batch
+    marks each of its merge requests as failed.
+    :param project_id: ID of the GitLab project
+    :param stale: List of (iid, updated_at) tuples to sync
+    :param concurrency: Maximum number of batches fetched concurrently
+    :param on_synced: Optional function called with (iid, (notes, commits) or exception) per merge request
+    :param failures: Dictionary of iid -> error, updated in place
+    """
+    if not stale:
+        return
+    store = get_store()
+    full_path = await get_project_path(project_id)
+    batches = [stale[i:i + GITLAB_GRAPHQL_BATCH_SIZE] for i in range(0, len(stale), GITLAB_GRAPHQL_BATCH_SIZE)]
+
+    async def fetch_batch(batch):
+        result = await fetch_merge_request_activity(full_path, [iid for iid, _ in batch])
+        await store.run(_store_batch, store, project_id, batch, result)
+        return result
+
+    def record_batch(index, result):
+        for iid, _ in batches[index]:
+            if isinstance(result, Exception):
+                mr_result = result
+            elif iid in result:
+                mr_result = result[iid]
+            else:
+                mr_result = Exception(f'Merge request {iid} missing from GraphQL response')
+            if isinstance(mr_result, Exception):
+                failures[iid] = mr_result
+            if on_synced is not None:
+                on_synced(iid, mr_result)
+
+    await gather_bounded(batches, fetch_batch, concurrency, on_result=record_batch)
+
+def _store_batch(store, project_id, batch, result):
+    """
+    Stores the activity of each merge request of a GraphQL batch that came back without an error
+    :param store: MergeRequestStore
+    :param project_id: ID of the GitLab project
+    :param batch: List of (iid, updated_at) tuples
+    :param result: Dictionary of iid -> (notes, commits) or exception
+    """
+    for iid, updated_at in batch:
+        mr_result = result.get(iid)
+        if mr_result is not None and not isinstance(mr_result, Exception):
+            notes, commits = mr_result
+            store.replace_activity(project_id, iid, updated_at, notes, commits)
+
+def _fetch_backend(backend):
+    """
+    Resolves and validates the fetch backend
+    :param backend: 'rest', 'graphql' or None for GITLAB_FETCH_BACKEND
+    :return: Backend name
+    :raises: ValueError for an unknown backend
+    """
+    backend = backend or GITLAB_FETCH_BACKEND
+    if backend not in FETCH_BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(FETCH_BACKENDS)}")
+    return backend
+
+async def fetch_merge_request_notes(project_id, merge_request_iid):
+    """
+    Fetches all notes of a merge request with their award emoji. The REST note
+    listing leaves the emoji out, so they are fetched per comment; system notes
+    are skipped.
+    :param project_id: ID of the GitLab project
+    :param merge_request_iid: IID of the merge request
+    :return: List of notes, each with an 'award_emoji' list
+    :raises: The first error of the emoji requests, so that the merge request is synced again later
+    """
+    path = f'/projects/{project_id}/merge_requests/{merge_request_iid}/notes'
+    notes = await gitlab_get_all(path)
+    comments = [note for note in notes if not note.get('system')]
+    award_emoji = await gather_bounded(comments, lambda note: gitlab_get_all(f"{path}/{note['id']}/award_emoji"))
+    for note, emoji in zip(comments, award_emoji):
+        if isinstance(emoji, Exception):
+            raise emoji
+        note['award_emoji'] = emoji
+    for note in notes:
+        note.setdefault('award_emoji', [])
+    return notes
+
+async def fetch_merge_request_commits(project_id, merge_request_iid):
+    """
+    Fetches all commits of a merge request
+    :param project_id: ID of the GitLab project
+    :param merge_request_iid: IID of the merge request
+    :return: List of commits
+    """
+    return await gitlab_get_all(f'/projects/{project_id}/merge_requests/{merge_request_iid}/commits')
+
+def _participants(mr, notes, commits):
+    """
+    Collects everyone who took part in a merge request
+    :param mr: Merge request dictionary
+    :param notes: Notes of the merge request
+    :param commits: Commits of the merge request
+    :return: Sorted list of unique participants
+    """
+    participants = {mr['author']['username']}
+    for note in notes:
+        participants.add(note['author']['username'])
+        for emoji in note.get('award_emoji', []):
+            participants.add(emoji['user']['username'])
+    for commit in commits:
+        participants.add(commit['author_name'])
+    return sorted(participants)
+
+async def fetch_merge_requests(state, project_id, limit, max_age, repository_url):
     """
     Fetches merge requests from GitLab API
-    :param state: State of merge requests to fetch ('opened' or 'closed')
+    :param state: State of merge requests to fetch ('opened', 'closed' or 'merged')
     :param project_id: ID of the GitLab project
     :param limit: Maximum number of merge requests to fetch
     :param max_age: Maximum age of merge requests in days
     :return: List of merge requests
     :raises: Exception if there's an error fetching merge requests
     """
+    merge_requests = [mr async for mr in iter_merge_requests(state, project_id, max_age, limit)]
+    logger.info(f"Successfully fetched {len(merge_requests)} {state} merge requests")
+    return merge_requests
+
+async def iter_merge_requests(state, project_id, max_age, limit=None, on_page=None, page_concurrency=None):
+    """
+    Streams merge requests of one state from the GitLab API, newest first
+    :param state: State of merge requests to fetch ('opened', 'closed' or 'merged')
+    :param project_id: ID of the GitLab project
+    :param max_age: Maximum age of merge requests in days
+    :param limit: Optional maximum number of merge requests; no further pages are requested once reached
+    :param on_page: Optional coroutine function awaited with each page of merge requests as it arrives
+    :param page_concurrency: Maximum number of pages fetched at once, defaults to the pages `limit` still needs
+    :return: Async generator of merge requests
+    :raises: Exception if there's an error fetching merge requests
+    """
     logger.info(f"Fetching {state} merge requests for project ID: {project_id}")
+    oldest_date = datetime.now() - timedelta(days=max_age)
+    params = {
+        'state': state,
+        'created_after': oldest_date.isoformat(),
+        'order_by': 'created_at',
+        'sort': 'desc',
+        'per_page': min(limit, GITLAB_PER_PAGE) if limit else GITLAB_PER_PAGE,
+    }
+    # Don't fetch pages ahead beyond what `limit` can use
+    if page_concurrency is None and limit:
+        page_concurrency = -(-limit // params['per_page']) - 1
+    count = 0
+
     try:
-        oldest_date = datetime.now() - timedelta(days=max_age)
-        params = {
-            'state': state,
-            'per_page': 100,  # Fetch maximum allowed per page
-            'created_after': oldest_date.isoformat()
-        }
-        merge_requests = []
-        page = 1
-
-        while len(merge_requests) < limit:
-            params['page'] = page
-            response = requests.get(
-                f'{GITLAB_API_URL}/projects/{project_id}/merge_requests',
-                headers={'PRIVATE-TOKEN': GITLAB_TOKEN},
-                params=params
-            )
-            response.raise_for_status()
-            page_mrs = response.json()
+        async for page_mrs in paginate(f'/projects/{project_id}/merge_requests', params,
+                                       page_concurrency=page_concurrency):
             if not page_mrs:
-                break
-            merge_requests.extend(page_mrs)
-            page += 1
-
-        logger.info(f"Successfully fetched {len(merge_requests)} {state} merge requests")
-        return merge_requests[:limit]
-    except requests.exceptions.RequestException as error:
-        if error.response:
+                return
+            if on_page is not None:
+                await on_page(page_mrs)
+            for mr in page_mrs:
+                yield mr
+                count += 1
+                if limit and count >= limit:
+                    return
+    except httpx.HTTPError as error:
+        if isinstance(error, httpx.HTTPStatusError):
             if error.response.status_code == 401:
                 logger.error("Unauthorized. Please check your GitLab token.")
                 raise Exception('Unauthorized. Please check your GitLab token.')
@@ -148,86 +498,105 @@ def fetch_merge_requests(state, project_id, limit, max_age, repository_url):
         logger.error(f"Error fetching merge requests: {str(error)}")
         raise
 
-def fetch_merge_request_participants(project_id, merge_request_iid):
+async def fetch_merge_request_participants(project_id, mr):
     """
     Fetches participants for a specific merge request
     :param project_id: ID of the GitLab project
-    :param merge_request_iid: IID of the merge request
-    :return: Set of unique participants
+    :param mr: Merge request dictionary as returned by the merge request list
+    :return: Sorted list of unique participants
     """
-    logger.info(f"Fetching participants for merge request {merge_request_iid} in project {project_id}")
-    participants = set()
-
+    logger.info(f"Fetching participants for merge request {mr['iid']} in project {project_id}")
     try:
-        # Fetch merge request details
-        mr_response = requests.get(
-            f'{GITLAB_API_URL}/projects/{project_id}/merge_requests/{merge_request_iid}',
-            headers={'PRIVATE-TOKEN': GITLAB_TOKEN}
-        )
-        mr_response.raise_for_status()
-        mr_data = mr_response.json()
-        
-        # Add author
-        participants.add(mr_data['author']['username'])
-
-        # Fetch comments
-        comments_response = requests.get(
-            f'{GITLAB_API_URL}/projects/{project_id}/merge_requests/{merge_request_iid}/notes',
-            headers={'PRIVATE-TOKEN': GITLAB_TOKEN}
-        )
-        comments_response.raise_for_status()
-        comments = comments_response.json()
-
-        # Add commenters and reactors
-        for comment in comments:
-            participants.add(comment['author']['username'])
-            if 'award_emoji' in comment:
-                for emoji in comment['award_emoji']:
-                    participants.add(emoji['user']['username'])
-
-        # Fetch commits
-        commits_response = requests.get(
-            f'{GITLAB_API_URL}/projects/{project_id}/merge_requests/{merge_request_iid}/commits',
-            headers={'PRIVATE-TOKEN': GITLAB_TOKEN}
-        )
-        commits_response.raise_for_status()
-        commits = commits_response.json()
-
-        # Add committers
-        for commit in commits:
-            participants.add(commit['author_name'])
-
-        logger.info(f"Successfully fetched {len(participants)} participants for merge request {merge_request_iid}")
-        return list(participants)
-    except requests.exceptions.RequestException as error:
-        logger.error(f"Error fetching participants for merge request {merge_request_iid}: {str(error)}")
+        # The list payload already carries the author, so only notes and commits are fetched
+        notes = await fetch_merge_request_notes(project_id, mr['iid'])
+        commits = await fetch_merge_request_commits(project_id, mr['iid'])
+        participants = _participants(mr, notes, commits)
+        logger.info(f"Successfully fetched {len(participants)} participants for merge request {mr['iid']}")
+        return participants
+    except httpx.HTTPError as error:
+        logger.error(f"Error fetching participants for merge request {mr['iid']}: {str(error)}")
         raise
 
-def get_merge_requests_with_participants(project_id, total, max_age, repository_url):
+async def get_merge_requests_with_participants(project_id, total, max_age, repository_url, concurrency=None, backend=None,
+                                               fields=None):
     """
     Fetches merge requests with their participants
     :param project_id: ID of the GitLab project
     :param total: Maximum number of merge requests to fetch
     :param max_age: Maximum age of merge requests in days
     :param repository_url: URL of the GitLab repository
+    :param concurrency: Maximum number of merge requests fetched concurrently
+    :param backend: 'rest' or 'graphql', defaults to GITLAB_FETCH_BACKEND
+    :param fields: Optional tuple of fields; merge requests are then returned as slim MergeRequestRecords
     :return: List of merge requests with participants
     """
+    all_mrs = [
+        mr async for mr in iter_merge_requests_with_participants(project_id, total, max_age, repository_url, concurrency, backend,
+                                                                 fields)
+    ]
+    logger.info(f"Successfully fetched {len(all_mrs)} merge requests with participants")
+    return all_mrs
+
+async def iter_merge_requests_with_participants(project_id, total, max_age, repository_url, concurrency=None, backend=None,
+                                                fields=None):
+    """
+    Streams merge requests with their participants, resolving participants in
+    batches of PARTICIPANTS_BATCH_SIZE as merge requests arrive
+    :param project_id: ID of the GitLab project
+    :param total: Maximum number of merge requests to fetch
+    :param max_age: Maximum age of merge requests in days
+    :param repository_url: URL of the GitLab repository
+    :param concurrency: Maximum number of merge requests fetched concurrently
+    :param backend: 'rest' or 'graphql', defaults to GITLAB_FETCH_BACKEND
+    :param fields: Optional tuple of fields; merge requests are then yielded as slim MergeRequestRecords
+    :return: Async generator of merge requests with participants, newest first
+    """
     logger.info(f"Fetching merge requests with participants for project ID: {project_id}")
+    backend = _fetch_backend(backend)
     try:
-        all_mrs = scan_gitlab_repository(total, max_age, repository_url)
-
-        for mr in all_mrs:
-            mr['participants'] = fetch_merge_request_participants(project_id, mr['iid'])
-
-        logger.info(f"Successfully fetched {len(all_mrs)} merge requests with participants")
-        return all_mrs
+        batch = []
+        async for mr in iter_gitlab_repository(total, max_age, repository_url):
+            batch.append(mr)
+            if len(batch) >= PARTICIPANTS_BATCH_SIZE:
+                for mr_with_participants in await _add_participants(project_id, batch, concurrency, backend):
+                    yield MergeRequestRecord(mr_with_participants, fields) if fields else mr_with_participants
+                batch = []
+        for mr_with_participants in await _add_participants(project_id, batch, concurrency, backend):
+            yield MergeRequestRecord(mr_with_participants, fields) if fields else mr_with_participants
     except Exception as error:
         logger.error(f'Error fetching merge requests with participants: {error}')
         raise
 
+async def _add_participants(project_id, merge_requests, concurrency=None, backend=None):
+    """
+    Sets 'participants' on each merge request from its stored or freshly synced activity
+    :param project_id: ID of the GitLab project
+    :param merge_requests: List of merge request dictionaries, updated in place
+    :param concurrency: Maximum number of merge requests fetched concurrently
+    :param backend: 'rest' or 'graphql', defaults to GITLAB_FETCH_BACKEND
+    :return: The same list of merge requests
+    """
+    if not merge_requests:
+        return merge_requests
+    iids = [mr['iid'] for mr in merge_requests]
+    with _phase('sync_activity'):
+        failures = await sync_merge_request_activity(project_id, iids, concurrency, backend=backend)
+    store = get_store()
+    activity = await store.run(store.get_activity, project_id, iids)
+
+    for mr in merge_requests:
+        if mr['iid'] in failures:
+            # Keep the rest of the batch; flag the merge request that failed
+            mr['participants'] = []
+            mr['participants_error'] = str(failures[mr['iid']])
+        else:
+            notes, commits = activity.get(mr['iid'], ([], []))
+            mr['participants'] = _participants(mr, notes, commits)
+    return merge_requests
+
 import time
 
-def get_total_merge_requests(project_id, repository_url):
+async def get_total_merge_requests(project_id, repository_url):
     """
     Fetches the total number of merge requests for the project
     :param project_id: ID of the GitLab project
@@ -236,117 +605,334 @@ def get_total_merge_requests(project_id, repository_url):
     """
     logger.info(f"Fetching total number of merge requests for project ID: {project_id}")
     try:
-        response = requests.get(
-            f'{GITLAB_API_URL}/projects/{project_id}/merge_requests',
-            headers={'PRIVATE-TOKEN': GITLAB_TOKEN},
-            params={'state': 'all', 'per_page': 1}
-        )
-        response.raise_for_status()
-        total_mrs = int(response.headers.get('X-Total', 0))
+        total_mrs = await _get_merge_request_count(project_id, repository_url, 'all')
         logger.info(f"Successfully fetched total number of merge requests: {total_mrs}")
         return total_mrs
-    except requests.exceptions.RequestException as error:
+    except httpx.HTTPError as error:
         logger.error(f"Error fetching total number of merge requests: {str(error)}")
         raise
 
-def get_all_contributors(project_id, repository_url):
+async def get_all_contributors(project_id, repository_url, concurrency=None, progress_callback=None, stats=None, backend=None,
+                               members_only=False):
     """
     Fetches all contributors from merge requests with their participation details
     :param project_id: ID of the GitLab project
     :param repository_url: URL of the GitLab repository
-    :return: Tuple of (List of contributors with participation details, Estimated total time in seconds)
+    :param concurrency: Maximum number of merge requests fetched concurrently
+    :param progress_callback: Optional function called with (processed, total, contributors) as merge requests are processed
+    :param stats: Optional dictionary filled with merge request and GitLab API call counts of the scan
+    :param backend: 'rest' or 'graphql', defaults to GITLAB_FETCH_BACKEND
+    :param members_only: Only return contributors listed in MEMBERS_FILE
+    :return: Tuple of (List of contributors with participation details and their event Timeline, Time spent in seconds)
     """
     logger.info(f"Fetching all contributors with participation details for project ID: {project_id}")
+    backend = _fetch_backend(backend)
     try:
         contributors = {}
-        page = 1
-        total_time = 0
         start_time = time.time()
+        with SCANS_IN_PROGRESS.track_inprogress(scope='project'):
+            project_stats = await _collect_contributors(project_id, contributors, concurrency, progress_callback, backend)
+        if stats is not None:
+            stats.update(project_stats)
+        total_time = time.time() - start_time
+        logger.info(f"Successfully fetched participation details for {len(contributors)} contributors in {total_time:.1f}s")
+        return contributor_list(contributors, members_only), total_time
+    except Exception as error:
+        logger.error(f'Error fetching contributors with participation details: {error}')
+        raise
 
-        total_mrs = get_total_merge_requests(project_id, repository_url)
-        
-        while True:
-            response = requests.get(
-                f'{GITLAB_API_URL}/projects/{project_id}/merge_requests',
-                headers={'PRIVATE-TOKEN': GITLAB_TOKEN},
-                params={'page': page, 'per_page': 100, 'state': 'all'}
-            )
-            response.raise_for_status()
-            merge_requests = response.json()
-            if not merge_requests:
-                break
+async def _collect_contributors(project_id, contributors, concurrency, progress_callback, backend):
+    """
+    Syncs a project and adds the activity of all its merge requests to the contributor totals
+    :param project_id: ID of the GitLab project
+    :param contributors: Dictionary of username -> participation details, updated in place
+    :param concurrency: Maximum number of merge requests fetched concurrently
+    :param progress_callback: Optional function called with (processed, total, contributors) as merge requests are processed
+    :param backend: 'rest' or 'graphql'
+    :return: Dictionary of merge request and GitLab API call counts
+    """
+    sync_start = time.perf_counter()
+    with _phase('sync_merge_requests'):
+        await sync_merge_requests(project_id)
+    sync_seconds = time.perf_counter() - sync_start
+    store = get_store()
+    with _phase('aggregate_stored'):
+        total_mrs, fresh, merge_requests = await store.run(_split_stored, store, project_id)
+        stale_iids = set(merge_requests)
+
+        # Merge requests that are already up to date in the store are parsed and tallied by the worker pool right away
+        merge_contributors(contributors, await tally_in_pool(fresh))
+        del fresh
+    processed = total_mrs - len(stale_iids)
+    if progress_callback is not None:
+        progress_callback(processed, total_mrs, contributors)
+
+    def on_synced(iid, result):
+        nonlocal processed
+        processed += 1
+        if isinstance(result, Exception):
+            logger.error(f"Skipping merge request {iid}: {result}")
+        else:
+            notes, commits = result
+            add_merge_request_activity(contributors, merge_requests[iid], notes, commits)
+        if progress_callback is not None:
+            progress_callback(processed, total_mrs, contributors)
+
+    sync_start = time.perf_counter()
+    with count_requests() as counter, _phase('sync_activity'):
+        await sync_merge_request_activity(project_id, concurrency=concurrency, on_synced=on_synced, backend=backend)
+    sync_seconds += time.perf_counter() - sync_start
+    synced = len(stale_iids)
+    api_calls_per_mr = counter['requests'] / synced if synced else 0.0
+    logger.info(f"Synced {synced} merge requests with {counter['requests']} API calls ({api_calls_per_mr:.2f} per MR)")
+    return {
+        'backend': backend,
+        'merge_requests': total_mrs,
+        'synced_merge_requests': synced,
+        'sync_seconds': sync_seconds,
+        'api_calls': counter['requests'],
+        'api_calls_per_mr': api_calls_per_mr,
+    }
+
+def _split_stored(store, project_id):
+    """
+    Loads the stored activity of a project and splits it into up-to-date rows and stale merge requests
+    :param store: MergeRequestStore
+    :param project_id: ID of the GitLab project
+    :return: Tuple of (number of stored merge requests, list of fresh raw activity rows, dictionary of iid -> decoded stale merge request)
+    """
+    raw_activity = store.get_raw_activity(project_id)
+    stale_iids = {iid for iid, _ in store.stale_merge_requests(project_id)}
+    fresh = [row for iid, row in raw_activity.items() if iid not in stale_iids]
+    stale = {iid: loads(raw_activity[iid][0]) for iid in stale_iids if iid in raw_activity}
+    return len(raw_activity), fresh, stale
+
+def get_stored_contributors(project_id, members_only=False, store=None):
+    """
+    Aggregates contributors from the local store alone, without calling GitLab.
+    Merge requests whose activity is stale count with the activity stored so far.
+    :param project_id: ID of the GitLab project
+    :param members_only: Only return contributors listed in MEMBERS_FILE
+    :param store: MergeRequestStore, defaults to the shared store
+    :return: List of contributors with participation details and their event Timeline
+    """
+    contributors = tally_merge_requests((store or get_store()).get_raw_activity(project_id).values())
+    return contributor_list(contributors, members_only)
+
+def contributor_list(contributors, members_only=False):
+    """
+    Sorts the contributor timelines and flattens the totals into a list
+    :param contributors: Dictionary of username -> participation details
+    :param members_only: Only keep contributors listed in MEMBERS_FILE
+    :return: List of contributor dictionaries
+    """
+    roster = load_members() if members_only else None
+    result = []
+    for username, data in contributors.items():
+        if roster is not None and not _is_member(roster, username, data['name']):
+            continue
+        data['timeline'].sort()
+        result.append({'username': username, **data})
+    return result
+
+async def get_group_projects(group_url):
+    """
+    Lists the projects of a GitLab group and its subgroups, skipping archived projects
+    :param group_url: URL of the GitLab group, e.g. 'https://gitlab.com/groups/my-group' or 'https://gitlab.com/my-group'
+    :return: List of project dictionaries with 'id', 'name', 'path_with_namespace' and 'web_url'
+    :raises: Exception if there's an error fetching the projects
+    """
+    if not group_url:
+        logger.error("group_url is not set")
+        raise Exception('group_url is not set')
+
+    cache_key = (group_url, GITLAB_TOKEN, 'projects')
+    projects = project_cache.get(cache_key)
+    if projects is not None:
+        return projects
+
+    path = urlparse(group_url).path.strip('/')
+    if path.startswith('groups/'):
+        path = path[len('groups/'):]
+    encoded_path = quote(path, safe='')
+    params = {'include_subgroups': 'true', 'archived': 'false', 'with_merge_requests_enabled': 'true', 'simple': 'true'}
+
+    try:
+        projects = []
+        async for page in paginate(f'/groups/{encoded_path}/projects', params):
+            projects.extend(page)
+        project_cache.set(cache_key, projects)
+        for project in projects:
+            # Saves a lookup when the GraphQL backend needs the project path
+            project_cache.set((project['id'], GITLAB_TOKEN), project)
+        logger.info(f"Found {len(projects)} projects in group {path}")
+        return projects
+    except httpx.HTTPError as error:
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code == 401:
+                logger.error("Unauthorized. Please check your GitLab token.")
+                raise Exception('Unauthorized. Please check your GitLab token.')
+            elif error.response.status_code == 404:
+                logger.error("Group not found. Please check your group URL.")
+                raise Exception('Group not found. Please check your group URL.')
+        logger.error(f"Error listing group projects: {str(error)}")
+        raise
 
-            for mr in merge_requests:
-                if page == 1 and merge_requests.index(mr) == 0:
-                    # Measure time for processing one MR
-                    mr_start_time = time.time()
-                created_at = datetime.fromisoformat(mr['created_at'].replace('Z', '+00:00'))
-                author = mr['author']['username']
-                if author not in contributors:
-                    contributors[author] = {'opened': 0, 'committed': 0, 'commented': 0, 'reacted': 0, 'timeline': []}
-                contributors[author]['opened'] += 1
-                contributors[author]['timeline'].append({'date': created_at, 'action': 'opened'})
-
-                participants = fetch_merge_request_participants(project_id, mr['iid'])
-                for participant in participants:
-                    if participant not in contributors:
-                        contributors[participant] = {'opened': 0, 'committed': 0, 'commented': 0, 'reacted': 0, 'timeline': []}
-                    if participant != author:
-                        contributors[participant]['committed'] += 1
-                        contributors[participant]['timeline'].append({'date': created_at, 'action': 'committed'})
-
-                comments_response = requests.get(
-                    f'{GITLAB_API_URL}/projects/{project_id}/merge_requests/{mr["iid"]}/notes',
-                    headers={'PRIVATE-TOKEN': GITLAB_TOKEN}
-                )
-                comments_response.raise_for_status()
-                comments = comments_response.json()
-                for comment in comments:
-                    commenter = comment['author']['username']
-                    comment_date = datetime.fromisoformat(comment['created_at'].replace('Z', '+00:00'))
-                    if commenter not in contributors:
-                        contributors[commenter] = {'opened': 0, 'committed': 0, 'commented': 0, 'reacted': 0, 'timeline': []}
-                    contributors[commenter]['commented'] += 1
-                    contributors[commenter]['timeline'].append({'date': comment_date, 'action': 'commented'})
-                    if 'award_emoji' in comment:
-                        for emoji in comment['award_emoji']:
-                            reactor = emoji['user']['username']
-                            if reactor not in contributors:
-                                contributors[reactor] = {'opened': 0, 'committed': 0, 'commented': 0, 'reacted': 0, 'timeline': []}
-                            contributors[reactor]['reacted'] += 1
-                            contributors[reactor]['timeline'].append({'date': comment_date, 'action': 'reacted'})
-
-                if page == 1 and merge_requests.index(mr) == 0:
-                    # Calculate time taken for one MR
-                    time_per_mr = time.time() - mr_start_time
-                    # Estimate total time
-                    total_time = time_per_mr * total_mrs
-
-            page += 1
-
-        logger.info(f"Successfully fetched participation details for {len(contributors)} contributors")
-        return [{'username': username, **data} for username, data in contributors.items()], total_time
+async def get_group_contributors(group_url, concurrency=None, progress_callback=None, stats=None, backend=None,
+                                 members_only=False, project_concurrency=None):
+    """
+    Fetches contributors across every project of a GitLab group. Up to
+    project_concurrency projects are crawled at once and share the merge request
+    concurrency between them; all requests go through the same per-host limit
+    and token rate limiter. Contributor totals and timelines are merged across
+    projects. A project that fails is reported in stats and left out.
+    :param group_url: URL of the GitLab group
+    :param concurrency: Maximum number of merge requests fetched concurrently across all projects
+    :param progress_callback: Optional function called with (processed, total, contributors) as merge requests are processed
+    :param stats: Optional dictionary filled with per-project and overall counts of the scan
+    :param backend: 'rest' or 'graphql', defaults to GITLAB_FETCH_BACKEND
+    :param members_only: Only return contributors listed in MEMBERS_FILE
+    :param project_concurrency: Maximum number of projects crawled at once, defaults to GITLAB_PROJECT_CONCURRENCY
+    :return: Tuple of (List of contributors with participation details and their event Timeline, Time spent in seconds)
+    """
+    logger.info(f"Fetching contributors for all projects in group: {group_url}")
+    backend = _fetch_backend(backend)
+    try:
+        start_time = time.time()
+        projects = await get_group_projects(group_url)
+        project_concurrency = max(1, project_concurrency or GITLAB_PROJECT_CONCURRENCY)
+        mr_concurrency = max(1, (concurrency or GITLAB_MR_CONCURRENCY) // min(project_concurrency, max(1, len(projects))))
+        contributors = {}
+        progress = {}
+
+        async def crawl(project):
+            def on_progress(processed, total, _):
+                progress[project['id']] = (processed, total)
+                if progress_callback is not None:
+                    progress_callback(sum(p for p, _ in progress.values()), sum(t for _, t in progress.values()), contributors)
+            return await _collect_contributors(project['id'], contributors, mr_concurrency, on_progress, backend)
+
+        with SCANS_IN_PROGRESS.track_inprogress(scope='group'):
+            results = await gather_bounded(projects, crawl, project_concurrency)
+        project_stats = {}
+        failed = {}
+        for project, result in zip(projects, results):
+            if isinstance(result, Exception):
+                logger.error(f"Skipping project {project['path_with_namespace']}: {result}")
+                failed[project['path_with_namespace']] = str(result)
+            else:
+                project_stats[project['path_with_namespace']] = result
+        if projects and len(failed) == len(projects):
+            raise Exception(f'All {len(projects)} projects of the group failed: {next(iter(failed.values()))}')
+
+        if stats is not None:
+            api_calls = sum(p['api_calls'] for p in project_stats.values())
+            synced = sum(p['synced_merge_requests'] for p in project_stats.values())
+            stats.update({
+                'backend': backend,
+                'projects': len(projects),
+                'merge_requests': sum(p['merge_requests'] for p in project_stats.values()),
+                'synced_merge_requests': synced,
+                'api_calls': api_calls,
+                'api_calls_per_mr': api_calls / synced if synced else 0.0,
+                'per_project': project_stats,
+                'failed_projects': failed,
+            })
+        total_time = time.time() - start_time
+        logger.info(f"Fetched {len(contributors)} contributors across {len(projects)} projects in {total_time:.1f}s")
+        return contributor_list(contributors, members_only), total_time
     except Exception as error:
-        logger.error(f'Error fetching contributors with participation details: {error}')
+        logger.error(f'Error fetching group contributors: {error}')
         raise
 
-def get_open_merge_requests_count(project_id):
+def load_members(path=None):
+    """
+    Reads the team roster, one username or display name per line
+    :param path: Roster file, defaults to MEMBERS_FILE
+    :return: Set of lower-cased roster entries
+    """
+    path = path or MEMBERS_FILE
+    try:
+        with open(path) as members_file:
+            return {line.strip().lower() for line in members_file if line.strip()}
+    except OSError as error:
+        logger.error(f"Error reading members file {path}: {str(error)}")
+        raise Exception(f'Members file {path} could not be read')
+
+def filter_members(contributors):
+    """
+    Keeps the contributors listed in MEMBERS_FILE
+    :param contributors: List of contributor dictionaries
+    :return: List of the contributors on the roster
+    """
+    roster = load_members()
+    return [contributor for contributor in contributors if _is_member(roster, contributor['username'], contributor.get('name'))]
+
+def _is_member(roster, username, name):
+    """
+    Checks a contributor against the roster by username or display name.
+    Commit authors are keyed by their display name, so both are compared.
+    """
+    return username.lower() in roster or (name is not None and name.lower() in roster)
+
+async def get_open_merge_requests_count(project_id, repository_url=None):
     """
     Fetches the count of open merge requests for the project
     :param project_id: ID of the GitLab project
+    :param repository_url: URL of the GitLab repository, used as the cache key
     :return: Count of open merge requests
     """
     logger.info(f"Fetching count of open merge requests for project ID: {project_id}")
     try:
-        response = requests.get(
-            f'{GITLAB_API_URL}/projects/{project_id}/merge_requests',
-            headers={'PRIVATE-TOKEN': GITLAB_TOKEN},
-            params={'state': 'opened', 'per_page': 1}
-        )
-        response.raise_for_status()
-        open_mrs_count = int(response.headers.get('X-Total', 0))
+        open_mrs_count = await _get_merge_request_count(project_id, repository_url, 'opened')
         logger.info(f"Successfully fetched count of open merge requests: {open_mrs_count}")
         return open_mrs_count
-    except requests.exceptions.RequestException as error:
+    except httpx.HTTPError as error:
         logger.error(f"Error fetching count of open merge requests: {str(error)}")
         raise
+
+async def _get_merge_request_count(project_id, repository_url, state):
+    """
+    Reads the X-Total merge request count for a state, caching it per repository and token
+    :param project_id: ID of the GitLab project
+    :param repository_url: URL of the GitLab repository, falls back to project_id as the cache key
+    :param state: Merge request state ('all', 'opened', ...)
+    :return: Number of merge requests
+    """
+    cache_key = (repository_url or project_id, GITLAB_TOKEN, state)
+    count = count_cache.get(cache_key)
+    if count is not None:
+        return count
+    response = await gitlab_get(
+        f'/projects/{project_id}/merge_requests',
+        params={'state': state, 'per_page': 1}
+    )
+    count = int(response.headers.get('X-Total', 0))
+    count_cache.set(cache_key, count)
+    return count
+
+async def invalidate_caches(repository_url=None):
+    """
+    Drops cached project details and counts
+    :param repository_url: Optional repository URL; all entries, including the HTTP cache, are dropped when omitted
+    :return: Number of removed entries
+    """
+    predicate = None
+    if repository_url:
+        predicate = lambda key: key[0] == repository_url
+    removed = project_cache.invalidate(predicate) + count_cache.invalidate(predicate)
+    http_cache = get_http_cache()
+    if http_cache is not None and not repository_url:
+        removed += await http_cache.clear()
+    return removed
+
+def get_cache_stats():
+    """
+    Returns statistics for the project and count caches and the HTTP cache
+    :return: Dictionary of cache name -> statistics
+    """
+    stats = {cache.name: cache.stats() for cache in (project_cache, count_cache)}
+    http_cache = get_http_cache()
+    if http_cache is not None:
+        stats['http'] = http_cache.stats()
+    return stats
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import struct
+import hashlib
+import logging
+from collections import OrderedDict
+import httpx
+
+# The cache is off unless a directory is configured
+GITLAB_HTTP_CACHE_DIR = os.environ.get('GITLAB_HTTP_CACHE_DIR')
+GITLAB_HTTP_CACHE_SIZE = int(os.environ.get('GITLAB_HTTP_CACHE_SIZE', 256 * 1024 * 1024))
+# Entries younger than this are served without revalidation; GitLab asks for revalidation on every use
+GITLAB_HTTP_CACHE_MAX_AGE = float(os.environ.get('GITLAB_HTTP_CACHE_MAX_AGE', 0))
+GITLAB_HTTP_CACHE_LEVEL = int(os.environ.get('GITLAB_HTTP_CACHE_LEVEL', 6))
+
+logger = logging.getLogger(__name__)
+
+# Requests with these parameters are not cached: callers derive them from the current time,
+# so the same request is never sent twice
+_TIME_RELATIVE_PARAMS = ('created_after', 'created_before')
+
+# Headers that describe the transfer rather than the stored, decoded body
+_SKIPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'set-cookie'}
+
+def _stored_headers(response):
+    """
+    Returns the headers of a response that are kept with a cache entry
+    :param response: httpx.Response
+    :return: Dictionary of lower-case header names to values
+    """
+    return {name: value for name, value in response.headers.items() if name not in _SKIPPED_HEADERS}
+
+class CachedResponse:
+    """
+    A response read back from the cache
+    """
+    __slots__ = ('key', 'status_code', 'headers', 'content', 'stored_at')
+
+    def __init__(self, key, status_code, headers, content, stored_at):
+        self.key = key
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.stored_at = stored_at
+
+    @property
+    def fresh(self):
+        return GITLAB_HTTP_CACHE_MAX_AGE > 0 and time.time() - self.stored_at < GITLAB_HTTP_CACHE_MAX_AGE
+
+    def validators(self):
+        """
+        Returns the conditional request headers that revalidate this response
+        :return: Dictionary with If-None-Match and/or If-Modified-Since
+        """
+        validators = {}
+        if 'etag' in self.headers:
+            validators['If-None-Match'] = self.headers['etag']
+        if 'last-modified' in self.headers:
+            validators['If-Modified-Since'] = self.headers['last-modified']
+        return validators
+
+    def to_response(self, request):
+        return httpx.Response(self.status_code, headers=self.headers, content=self.content, request=request)
+
+class HTTPCache:
+    """
+    On-disk cache of GET responses that carry an ETag or Last-Modified
+    validator. Each entry is one zlib-compressed file holding the status,
+    headers and body; the least recently used entries are removed once the
+    files exceed max_bytes in total. The index of existing files is built in
+    the default executor on first use.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._index = None
+
+    async def _ensure_index(self):
+        """
+        Waits until the entries already on disk are indexed, starting the directory
+        walk in the default executor on the first call
+        """
+        if self._index is None:
+            self._index = asyncio.ensure_future(self._load_index())
+        await asyncio.shield(self._index)
+
+    async def _load_index(self):
+        files = await asyncio.get_running_loop().run_in_executor(None, self._scan_directory)
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.bytes += size
+        logger.info(f"Loaded HTTP cache index with {len(self._entries)} entries ({self.bytes} bytes) from {self.directory}")
+
+    def _scan_directory(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.z'):
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, name[:-2], stat.st_size))
+        return files
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.z')
+
+    @staticmethod
+    def key(request, token):
+        """
+        Derives the cache key of a request. The token is part of the key because
+        GitLab responses depend on the permissions of the caller.
+        :param request: httpx.Request
+        :param token: GitLab token, or None
+        :return: Hex digest, or None if the request has time-relative parameters and isn't cached
+        """
+        if any(param in request.url.params for param in _TIME_RELATIVE_PARAMS):
+            return None
+        return hashlib.sha256(f"{token or ''}\n{request.method}\n{request.url}".encode()).hexdigest()
+
+    async def lookup(self, key):
+        """
+        Reads a cached response. The file is read and decompressed in the default
+        executor so that the event loop isn't blocked on disk.
+        :param key: Cache key
+        :return: CachedResponse, or None if the request is not cached
+        """
+        await self._ensure_index()
+        if key not in self._entries:
+            return None
+        try:
+            cached = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+        except (OSError, zlib.error) as error:
+            logger.warning(f"Dropping unreadable HTTP cache entry {key}: {error!r}")
+            self.errors += 1
+            await self._remove_async(key)
+            return None
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        return cached
+
+    def _read(self, key):
+        path = self._path(key)
+        with open(path, 'rb') as cache_file:
+            data = zlib.decompress(cache_file.read())
+        stored_at = os.path.getmtime(path)
+        header_length, = struct.unpack('>I', data[:4])
+        meta = json.loads(data[4:4 + header_length])
+        return CachedResponse(key, meta['status'], meta['headers'], data[4 + header_length:], stored_at)
+
+    async def revalidate(self, cached, response):
+        """
+        Records that GitLab confirmed a cached response with a 304. The headers of
+        the 304 replace the stored ones, since pagination headers such as X-Total
+        can change while the body and its ETag stay the same, and the entry is rewritten.
+        :param cached: CachedResponse that was revalidated
+        :param response: The 304 httpx.Response
+        """
+        self.revalidated += 1
+        cached.headers = {**cached.headers, **_stored_headers(response)}
+        cached.stored_at = time.time()
+        await self._write(cached.key, cached.status_code, cached.headers, cached.content)
+
+    async def store(self, key, response):
+        """
+        Caches a successful response if it carries a validator, and counts a miss
+        :param key: Cache key
+        :param response: httpx.Response whose body has been read
+        """
+        self.misses += 1
+        await self._ensure_index()
+        if response.status_code != 200 or not ('etag' in response.headers or 'last-modified' in response.headers):
+            return
+        await self._write(key, response.status_code, _stored_headers(response), response.content)
+
+    async def _write(self, key, status_code, headers, content):
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(
+                None, self._write_file, key, status_code, headers, content
+            )
+        except OSError as error:
+            logger.warning(f"Could not write HTTP cache entry {key}: {error!r}")
+            self.errors += 1
+            return
+        if size is None:
+            return
+        self.bytes += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        await self._evict()
+
+    def _write_file(self, key, status_code, headers, content):
+        meta = json.dumps({'status': status_code, 'headers': headers}).encode()
+        data = zlib.compress(struct.pack('>I', len(meta)) + meta + content, GITLAB_HTTP_CACHE_LEVEL)
+        if len(data) > self.max_bytes:
+            return None
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(temporary_path, 'wb') as cache_file:
+            cache_file.write(data)
+        os.replace(temporary_path, path)
+        return len(data)
+
+    async def _evict(self):
+        while self.bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            await self._remove_async(key)
+            self.evictions += 1
+
+    async def _remove_async(self, key):
+        self.bytes -= self._entries.pop(key, 0)
+        await asyncio.get_running_loop().run_in_executor(None, self._remove_file, key)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _remove_files(self, keys):
+        for key in keys:
+            self._remove_file(key)
+
+    async def clear(self):
+        """
+        Removes every cached response, deleting the files in the default executor
+        :return: Number of removed entries
+        """
+        await self._ensure_index()
+        keys = list(self._entries)
+        self._entries.clear()
+        self.bytes = 0
+        await asyncio.get_running_loop().run_in_executor(None, self._remove_files, keys)
+        removed = len(keys)
+        logger.info(f"Cleared {removed} entries from the HTTP cache")
+        return removed
+
+    def stats(self):
+        """
+        Returns hit/revalidated/miss counters and occupancy of the cache
+        :return: Dictionary of cache statistics
+        """
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            'size': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'errors': self.errors,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'revalidated_ratio': self.revalidated / lookups if lookups else 0.0,
+            'miss_ratio': self.misses / lookups if lookups else 0.0,
+        }
+
+_http_cache = None
+
+def get_http_cache():
+    """
+    Returns the shared HTTP cache, or None when GITLAB_HTTP_CACHE_DIR is unset or GITLAB_HTTP_CACHE_SIZE is 0
+    :return: HTTPCache or None
+    """
+    global _http_cache
+    if _http_cache is None and GITLAB_HTTP_CACHE_DIR and GITLAB_HTTP_CACHE_SIZE > 0:
+        _http_cache = HTTPCache(GITLAB_HTTP_CACHE_DIR, GITLAB_HTTP_CACHE_SIZE)
+    return _http_cache
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from gitlab_scanner import get_project_id, get_all_contributors, get_group_contributors, filter_members
+from leaderboard import materialize_leaderboards
+
+JOB_HISTORY_SIZE = int(os.environ.get('JOB_HISTORY_SIZE', 100))
+JOB_EVENT_INTERVAL = float(os.environ.get('JOB_EVENT_INTERVAL', 0.5))
+JOB_EVENT_KEEPALIVE = float(os.environ.get('JOB_EVENT_KEEPALIVE', 15))
+
+logger = logging.getLogger(__name__)
+
+class ScanJob:
+    """
+    A contributor scan of a project or of every project in a group, running in the background with live progress
+    """
+
+    def __init__(self, repository_url, concurrency=None, backend=None, scope='project', members_only=False):
+        self.id = uuid.uuid4().hex
+        self.repository_url = repository_url
+        self.concurrency = concurrency
+        self.backend = backend
+        self.scope = scope
+        self.members_only = members_only
+        self.status = 'pending'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.processed = 0
+        self.total = None
+        # (processed, time) at the first progress report, which already counts the merge requests that were fresh in the store
+        self._sync_start = None
+        self.contributors = {}
+        self.result = None
+        self.error = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in ('completed', 'failed')
+
+    def update_progress(self, processed, total, contributors):
+        """
+        Records scan progress and wakes up event stream subscribers
+        :param processed: Number of merge requests processed so far
+        :param total: Total number of merge requests in the scan
+        :param contributors: Partial contributor aggregates
+        """
+        if self.status == 'pending':
+            self.status = 'running'
+        if self._sync_start is None:
+            self._sync_start = (processed, time.time())
+        self.processed = processed
+        self.total = total
+        self.contributors = contributors
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout):
+        """
+        Waits until the job reports progress or finishes
+        :param timeout: Maximum time to wait in seconds
+        :return: True if the job changed, False on timeout
+        """
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def progress(self):
+        """
+        Returns processed counts, throughput and ETA of the scan. The throughput only counts
+        merge requests synced from GitLab, not the ones tallied straight from the store.
+        :return: Progress dictionary
+        """
+        now = self.finished_at or time.time()
+        elapsed = now - self.started_at if self.started_at else 0
+        rate = 0.0
+        if self._sync_start is not None:
+            synced_from, synced_since = self._sync_start
+            if now > synced_since:
+                rate = (self.processed - synced_from) / (now - synced_since)
+        remaining = (self.total - self.processed) if self.total is not None else None
+        eta = remaining / rate if rate > 0 and remaining is not None else None
+        return {
+            'processed': self.processed,
+            'total': self.total,
+            'percent': 100.0 * self.processed / self.total if self.total else (100.0 if self.done else 0.0),
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': eta,
+        }
+
+    def partial_contributors(self, top=10, members_only=False):
+        """
+        Returns the current top contributors by total participation, without timelines
+        :param top: Number of contributors to return
+        :param members_only: Only return contributors listed in the members file
+        :return: List of contributor dictionaries
+        """
+        totals = [
+            {'username': username, 'name': data['name'], 'opened': data['opened'], 'committed': data['committed'],
+             'commented': data['commented'], 'reacted': data['reacted']}
+            for username, data in list(self.contributors.items())
+        ]
+        if members_only:
+            totals = filter_members(totals)
+        totals.sort(key=lambda c: c['opened'] + c['committed'] + c['commented'] + c['reacted'], reverse=True)
+        return totals[:top]
+
+    def to_dict(self, include_result=False, members_only=False):
+        """
+        Serializes the job for the API
+        :param include_result: Include the full contributor result of a completed job
+        :param members_only: Only include contributors listed in the members file
+        :return: Job dictionary
+        """
+        data = {
+            'job_id': self.id,
+            'repository_url': self.repository_url,
+            'scope': self.scope,
+            'members_only': self.members_only,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'progress': self.progress(),
+            'partial_contributors': self.partial_contributors(members_only=members_only),
+            'error': self.error,
+        }
+        if include_result and self.result is not None:
+            data['result'] = self.result
+            if members_only:
+                data['result'] = {**self.result, 'contributors': filter_members(self.result['contributors'])}
+        return data
+
+class JobManager:
+    """
+    Starts contributor scans in the background and deduplicates them per repository or group
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._active = {}
+        self._tasks = set()
+
+    def start_contributor_scan(self, repository_url, concurrency=None, backend=None, scope='project', members_only=False):
+        """
+        Starts a contributor scan, or returns the one already running for the repository.
+        Scans tally every contributor; the members filter is applied when results are read,
+        so members-only and full requests share one scan.
+        :param repository_url: URL of the GitLab repository, or of the group when scope is 'group'
+        :param concurrency: Maximum number of merge requests fetched concurrently
+        :param backend: 'rest' or 'graphql', defaults to GITLAB_FETCH_BACKEND
+        :param scope: 'project' to scan one repository, 'group' to scan every project of a group
+        :param members_only: Also materialize members-only leaderboards when the scan completes
+        :return: ScanJob
+        """
+        key = (scope, repository_url)
+        job = self._active.get(key)
+        if job is not None and not job.done:
+            logger.info(f"Reusing running scan job {job.id} for {repository_url}")
+            job.members_only = job.members_only or members_only
+            return job
+
+        job = ScanJob(repository_url, concurrency, backend, scope, members_only)
+        self.jobs[job.id] = job
+        self._active[key] = job
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._prune()
+        logger.info(f"Started scan job {job.id} for {repository_url}")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def measured_rate(self, repository_url):
+        """
+        Returns the sync throughput of the latest completed scan of a repository that synced
+        merge requests from GitLab. Merge requests already fresh in the store cost no requests
+        and are not counted.
+        :param repository_url: URL of the repository
+        :return: Merge requests synced per second, or None if no such scan has completed
+        """
+        for job in reversed(list(self.jobs.values())):
+            if job.status != 'completed' or job.repository_url != repository_url:
+                continue
+            stats = job.result.get('stats', {})
+            if stats.get('synced_merge_requests') and stats.get('sync_seconds'):
+                return stats['synced_merge_requests'] / stats['sync_seconds']
+        return None
+
+    def running_count(self):
+        return sum(1 for job in self.jobs.values() if not job.done)
+
+    def status_counts(self):
+        """
+        Counts the jobs in each status
+        :return: Dictionary of status -> number of jobs
+        """
+        counts = {status: 0 for status in ('pending', 'running', 'completed', 'failed')}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return counts
+
+    async def _run(self, job):
+        job.started_at = time.time()
+        job.status = 'running'
+        try:
+            stats = {}
+            if job.scope == 'group':
+                contributors, total_time = await get_group_contributors(
+                    job.repository_url, job.concurrency, job.update_progress, stats, job.backend
+                )
+            else:
+                project_id = await get_project_id(job.repository_url)
+                contributors, total_time = await get_all_contributors(
+                    project_id, job.repository_url, job.concurrency, job.update_progress, stats, job.backend
+                )
+            materialize_leaderboards(job.repository_url, contributors)
+            if job.members_only:
+                materialize_leaderboards(job.repository_url, filter_members(contributors), True)
+            job.result = {'contributors': contributors, 'estimated_time': total_time, 'stats': stats}
+            job.status = 'completed'
+        except Exception as error:
+            logger.error(f"Scan job {job.id} failed: {str(error)}")
+            job.error = str(error)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            key = (job.scope, job.repository_url)
+            if self._active.get(key) is job:
+                del self._active[key]
+            job._notify()
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.done]
+        for job in finished[:max(0, len(self.jobs) - JOB_HISTORY_SIZE)]:
+            del self.jobs[job.id]
+
+    async def events(self, job, members_only=False):
+        """
+        Yields server-sent events describing the job until it finishes
+        :param job: ScanJob to follow
+        :param members_only: Only include contributors listed in the members file
+        :return: Async generator of SSE-formatted strings
+        """
+        while True:
+            if job.done:
+                event = 'completed' if job.status == 'completed' else 'failed'
+                yield _sse(event, job.to_dict(members_only=members_only))
+                return
+            yield _sse('progress', job.to_dict(members_only=members_only))
+            if not await job.wait_for_change(JOB_EVENT_KEEPALIVE):
+                yield ': keepalive\n\n'
+                continue
+            # Coalesce bursts of progress updates into one event per interval
+            await asyncio.sleep(JOB_EVENT_INTERVAL)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+job_manager = JobManager()
@@ -0,0 +1,112 @@
+import os
+import time
+import logging
+from bisect import bisect_left
+from timeline import ACTIONS
+
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 50))
+
+METRICS = ('total',) + ACTIONS
+WINDOWS = {'7d': 7, '30d': 30, '90d': 90, 'all': None}
+
+logger = logging.getLogger(__name__)
+
+class Leaderboards:
+    """
+    Top contributors per metric and time window, computed once from the
+    result of a scan so that dashboards don't have to sort the full
+    contributor list on every load
+    """
+
+    def __init__(self, contributors, size=LEADERBOARD_SIZE, now=None):
+        self.computed_at = now or time.time()
+        self.contributors = len(contributors)
+        self.series = {
+            window: _rank(contributors, self._cutoff(days), size)
+            for window, days in WINDOWS.items()
+        }
+
+    def _cutoff(self, days):
+        return None if days is None else int(self.computed_at - days * 86400)
+
+    def to_dict(self, window='all', metric=None, top=10):
+        """
+        Returns ready-to-plot series for one window
+        :param window: One of WINDOWS
+        :param metric: Optional metric, one of METRICS; all metrics are returned when omitted
+        :param top: Number of contributors per series
+        :return: Dictionary with the window, computation time and a labels/values series per metric
+        :raises: ValueError for an unknown window or metric
+        """
+        if window not in WINDOWS:
+            raise ValueError(f"window must be one of {', '.join(WINDOWS)}")
+        if metric is not None and metric not in METRICS:
+            raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+        metrics = (metric,) if metric is not None else METRICS
+        return {
+            'window': window,
+            'computed_at': self.computed_at,
+            'contributors': self.contributors,
+            'metrics': {
+                name: {
+                    'labels': [username for username, _ in self.series[window][name][:top]],
+                    'values': [value for _, value in self.series[window][name][:top]],
+                }
+                for name in metrics
+            },
+        }
+
+def _rank(contributors, cutoff, size):
+    """
+    Ranks contributors by each metric, counting only events at or after cutoff
+    :param contributors: List of contributor dictionaries with sorted Timelines
+    :param cutoff: Epoch seconds, or None to count every event
+    :param size: Number of contributors kept per metric
+    :return: Dictionary of metric -> list of (username, value), highest first, zero values left out
+    """
+    counts = {metric: [] for metric in METRICS}
+    for contributor in contributors:
+        if cutoff is None:
+            values = [contributor[action] for action in ACTIONS]
+        else:
+            timeline = contributor['timeline']
+            start = bisect_left(timeline.timestamps, cutoff)
+            values = [0] * len(ACTIONS)
+            for code in timeline.actions[start:]:
+                values[code] += 1
+        counts['total'].append((contributor['username'], sum(values)))
+        for action, value in zip(ACTIONS, values):
+            counts[action].append((contributor['username'], value))
+    return {
+        metric: sorted((entry for entry in entries if entry[1] > 0), key=lambda entry: (-entry[1], entry[0]))[:size]
+        for metric, entries in counts.items()
+    }
+
+_leaderboards = {}
+
+def materialize_leaderboards(repository_url, contributors, members_only=False):
+    """
+    Computes and keeps the leaderboards of a finished scan, replacing earlier ones
+    :param repository_url: URL of the scanned repository or group
+    :param contributors: List of contributor dictionaries with sorted Timelines
+    :param members_only: Whether the contributors were filtered by the members roster
+    :return: Leaderboards
+    """
+    leaderboards = Leaderboards(contributors)
+    _leaderboards[(repository_url, members_only)] = leaderboards
+    logger.info(f"Materialized leaderboards for {repository_url} from {len(contributors)} contributors")
+    return leaderboards
+
+def leaderboard_keys():
+    """
+    Lists the repositories and groups that have leaderboards
+    :return: List of (repository_url, members_only) tuples
+    """
+    return list(_leaderboards)
+
+def get_leaderboards(repository_url, members_only=False):
+    """
+    Returns the leaderboards of the latest scan of a repository or group
+    :return: Leaderboards, or None if the repository has not been scanned
+    """
+    return _leaderboards.get((repository_url, members_only))
@@ -0,0 +1,214 @@
+import os
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+METRICS_TRACE = os.environ.get('METRICS_TRACE', 'false').lower() in ('1', 'true', 'yes')
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger(__name__)
+
+_metrics = []
+_current_span = contextvars.ContextVar('metrics_current_span', default=None)
+
+class Metric:
+    """
+    Base class of the Prometheus metrics below. Values are kept per tuple of
+    label values; a metric created with `collect` reads its values from that
+    function at scrape time instead.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+        self._values = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Returns the samples of the metric
+        :return: List of (suffix, labels dictionary, value)
+        """
+        values = self._collect() if self._collect is not None else self._values
+        return [('', dict(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """
+        Increments the gauge for the duration of the block
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][index] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        for key, series in sorted(self._values.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, series['buckets']):
+                samples.append(('_bucket', {**labels, 'le': _format_value(bound)}, count))
+            samples.append(('_bucket', {**labels, 'le': '+Inf'}, series['count']))
+            samples.append(('_sum', labels, series['sum']))
+            samples.append(('_count', labels, series['count']))
+        return samples
+
+def render_metrics():
+    """
+    Renders every registered metric in the Prometheus text exposition format
+    :return: Metrics text
+    """
+    rendered = []
+    for metric in _metrics:
+        try:
+            rendered.append(metric.render())
+        except Exception as error:
+            logger.error(f"Error collecting metric {metric.name}: {str(error)}")
+    return '\n'.join(rendered) + '\n'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class Span:
+    """
+    One timed step of a traced request; children are the steps started while it was open
+    """
+    __slots__ = ('name', 'start', 'duration', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.children = []
+
+@contextmanager
+def span(name):
+    """
+    Records a step in the call tree of the current trace. Does nothing when no trace is active.
+    :param name: Name of the step, e.g. 'GET /projects/:id/merge_requests'
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield
+        return
+    node = Span(name)
+    parent.children.append(node)
+    token = _current_span.set(node)
+    try:
+        yield
+    finally:
+        node.duration = time.perf_counter() - node.start
+        _current_span.reset(token)
+
+@contextmanager
+def trace(name):
+    """
+    Starts a trace for the block and logs its call tree afterwards
+    :param name: Name of the root step, e.g. the HTTP route
+    """
+    root = Span(name)
+    token = _current_span.set(root)
+    try:
+        yield root
+    finally:
+        root.duration = time.perf_counter() - root.start
+        _current_span.reset(token)
+        logger.info("Trace:\n" + '\n'.join(format_trace(root)))
+
+def format_trace(node, depth=0):
+    """
+    Formats a call tree, collapsing siblings with the same name into one line with their count and timings
+    :param node: Root Span
+    :param depth: Indentation level
+    :return: List of lines
+    """
+    lines = [f"{'  ' * depth}{node.name} {1000 * (node.duration or 0):.1f}ms"]
+    groups = {}
+    for child in node.children:
+        groups.setdefault(child.name, []).append(child)
+    for name, children in groups.items():
+        if len(children) == 1:
+            lines.extend(format_trace(children[0], depth + 1))
+            continue
+        durations = [child.duration or 0 for child in children]
+        lines.append(
+            f"{'  ' * (depth + 1)}{name} x{len(children)} total {1000 * sum(durations):.1f}ms "
+            f"max {1000 * max(durations):.1f}ms"
+        )
+        # Descend into the slowest one so nested steps stay visible without repeating every sibling
+        slowest = max(children, key=lambda child: child.duration or 0)
+        lines.extend(format_trace(slowest, depth + 2)[1:])
+    return lines
@@ -0,0 +1,155 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+GITLAB_RATE_LIMIT = float(os.environ.get('GITLAB_RATE_LIMIT', 30))
+GITLAB_RATE_BURST = float(os.environ.get('GITLAB_RATE_BURST', 30))
+GITLAB_RATE_MIN = float(os.environ.get('GITLAB_RATE_MIN', 0.5))
+GITLAB_RATE_MAX = float(os.environ.get('GITLAB_RATE_MAX', 100))
+GITLAB_MAX_RETRIES = int(os.environ.get('GITLAB_MAX_RETRIES', 5))
+GITLAB_BACKOFF_BASE = float(os.environ.get('GITLAB_BACKOFF_BASE', 0.5))
+GITLAB_BACKOFF_MAX = float(os.environ.get('GITLAB_BACKOFF_MAX', 60))
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """
+    Token bucket shared by every request made with one GitLab token. The refill
+    rate adapts to GitLab's RateLimit-Remaining/RateLimit-Reset headers so that
+    the remaining budget lasts until the window resets, and a 429 pauses all
+    requests until Retry-After has passed.
+    """
+
+    def __init__(self, rate=GITLAB_RATE_LIMIT, burst=GITLAB_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.throttled_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.remaining = None
+        self.reset_at = None
+        self._completed = deque()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """
+        Waits until a request may be sent under the current rate and throttle state
+        """
+        while True:
+            now = time.monotonic()
+            if now < self.throttled_until:
+                await asyncio.sleep(self.throttled_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.requests += 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def observe(self, response):
+        """
+        Adapts the rate to the rate-limit headers of a GitLab response
+        :param response: httpx.Response
+        """
+        now = time.monotonic()
+        self._completed.append(now)
+        while self._completed and self._completed[0] < now - 60:
+            self._completed.popleft()
+
+        headers = response.headers
+        remaining = headers.get('RateLimit-Remaining')
+        reset = headers.get('RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            self.remaining = int(remaining)
+            self.reset_at = float(reset)
+            window = max(1.0, self.reset_at - time.time())
+            self.rate = min(GITLAB_RATE_MAX, max(GITLAB_RATE_MIN, self.remaining / window))
+        if response.status_code == 429:
+            self.throttle(retry_after(response) or GITLAB_BACKOFF_BASE)
+
+    def throttle(self, delay):
+        """
+        Pauses every request sharing this limiter
+        :param delay: Pause in seconds
+        """
+        self.throttled += 1
+        self.tokens = 0
+        self.throttled_until = max(self.throttled_until, time.monotonic() + delay)
+        logger.warning(f"GitLab rate limit hit, pausing requests for {delay:.1f}s")
+
+    def stats(self):
+        """
+        Returns the current rate, throughput and throttle state
+        :return: Dictionary of limiter statistics
+        """
+        now = time.monotonic()
+        recent = [t for t in self._completed if t >= now - 60]
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'tokens': self.tokens,
+            'throughput': len(recent) / 60.0,
+            'requests': self.requests,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'throttled_for': max(0.0, self.throttled_until - now),
+            'ratelimit_remaining': self.remaining,
+            'ratelimit_reset': self.reset_at,
+        }
+
+def retry_after(response):
+    """
+    Reads the Retry-After header of a response
+    :param response: httpx.Response
+    :return: Delay in seconds, or None if the header is missing or not a number
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def backoff_delay(attempt):
+    """
+    Returns a jittered exponential backoff delay
+    :param attempt: Number of the failed attempt, starting at 0
+    :return: Delay in seconds
+    """
+    return random.uniform(0, min(GITLAB_BACKOFF_MAX, GITLAB_BACKOFF_BASE * 2 ** attempt))
+
+def is_retryable(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+_limiters = {}
+
+def get_limiter(token):
+    """
+    Returns the limiter shared by all requests made with a token
+    :param token: GitLab token, or None
+    :return: RateLimiter
+    """
+    if token not in _limiters:
+        _limiters[token] = RateLimiter()
+    return _limiters[token]
+
+def get_rate_limit_stats():
+    """
+    Returns statistics for every limiter, keyed by a masked token
+    :return: Dictionary of masked token -> statistics
+    """
+    return {_mask(token): limiter.stats() for token, limiter in _limiters.items()}
+
+def _mask(token):
+    if not token:
+        return 'anonymous'
+    return f"{token[:4]}...({len(token)} chars)"
@@ -0,0 +1,44 @@
+MERGE_REQUEST_FIELDS = (
+    'id', 'iid', 'project_id', 'title', 'description', 'state', 'draft', 'author',
+    'created_at', 'updated_at', 'merged_at', 'closed_at', 'source_branch', 'target_branch',
+    'labels', 'web_url', 'participants', 'participants_error',
+)
+# What the merge request table needs
+DEFAULT_SLIM_FIELDS = ('id', 'iid', 'title', 'state', 'author', 'created_at', 'web_url')
+
+class MergeRequestRecord:
+    """
+    Compact projection of a GitLab merge request holding only the requested fields.
+    The author is reduced to the username.
+    """
+    __slots__ = ('fields',) + MERGE_REQUEST_FIELDS
+
+    def __init__(self, mr, fields=DEFAULT_SLIM_FIELDS):
+        self.fields = fields
+        for field in fields:
+            value = mr.get(field)
+            if field == 'author' and isinstance(value, dict):
+                value = value.get('username')
+            setattr(self, field, value)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+def parse_fields(fields):
+    """
+    Parses a comma-separated field list
+    :param fields: Field names such as 'iid,title,web_url', 'slim' for DEFAULT_SLIM_FIELDS, or None
+    :return: Tuple of field names, or None when no projection is requested
+    :raises: ValueError for an unknown field
+    """
+    if not fields:
+        return None
+    if fields == 'slim':
+        return DEFAULT_SLIM_FIELDS
+    parsed = tuple(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    if not parsed:
+        return None
+    unknown = [field for field in parsed if field not in MERGE_REQUEST_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Fields must be among {', '.join(MERGE_REQUEST_FIELDS)}")
+    return parsed
@@ -0,0 +1,318 @@
+"""
+Snapshots of a project's scan state, so that a new replica starts warm instead of re-crawling.
+
+A snapshot holds the stored merge requests, notes, award emoji and commits
+(participants are derived from these), the sync watermark and the
+contributor aggregates with their timelines. Each section is compressed
+separately and the index is written at the end of the file, so loading
+memory-maps the file and only decompresses the sections it uses, streaming
+their rows into the store.
+
+Run from the backend directory:
+    python snapshot.py dump https://gitlab.com/group/project snapshots/project.snap
+    python snapshot.py load snapshots/project.snap
+    python snapshot.py info snapshots/project.snap
+
+With GITLAB_SNAPSHOT_DIR set, the app loads every *.snap file in it on startup.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import struct
+import asyncio
+import logging
+import argparse
+from array import array
+from store import SNAPSHOT_COLUMNS, get_store
+from timeline import ACTIONS, Timeline
+from aggregation import loads
+from leaderboard import materialize_leaderboards
+from gitlab_client import close_client
+from gitlab_scanner import get_project_id, get_all_contributors, get_stored_contributors
+
+GITLAB_SNAPSHOT_DIR = os.environ.get('GITLAB_SNAPSHOT_DIR')
+GITLAB_SNAPSHOT_LEVEL = int(os.environ.get('GITLAB_SNAPSHOT_LEVEL', 6))
+
+MAGIC = b'GLSNAP'
+VERSION = 1
+# The file ends with the JSON index, its length and the magic bytes
+TRAILER = struct.Struct('>I6s')
+CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+class _SectionWriter:
+    """
+    Compresses one section into the open snapshot file
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.offset = output.tell()
+        self.compressor = zlib.compressobj(GITLAB_SNAPSHOT_LEVEL)
+        self.size = 0
+        self.rows = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self.output.write(self.compressor.compress(data))
+
+    def write_row(self, row):
+        self.write(json.dumps(row, separators=(',', ':')).encode() + b'\n')
+        self.rows += 1
+
+    def close(self):
+        self.output.write(self.compressor.flush())
+        return {'offset': self.offset, 'length': self.output.tell() - self.offset, 'size': self.size, 'rows': self.rows}
+
+def write_snapshot(path, project_id, repository_url, contributors, store=None):
+    """
+    Writes the stored state of a project and its contributor aggregates to a snapshot file.
+    The file is written next to the target and renamed into place.
+    :param path: Snapshot file to write
+    :param project_id: ID of the GitLab project
+    :param repository_url: URL of the repository, used as the leaderboard key on load
+    :param contributors: List of contributor dictionaries with sorted Timelines
+    :param store: MergeRequestStore, defaults to the shared store
+    :return: Snapshot index dictionary
+    """
+    store = store or get_store()
+    watermark = store.get_watermark(project_id)
+    if watermark is None:
+        raise Exception(f'Project {project_id} has not been synced, there is nothing to snapshot')
+    index = {
+        'version': VERSION,
+        'created_at': time.time(),
+        'project_id': project_id,
+        'repository_url': repository_url,
+        'watermark': watermark,
+        'byteorder': sys.byteorder,
+        'actions': ACTIONS,
+        'sections': {},
+    }
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as output:
+        output.write(MAGIC)
+        for table in SNAPSHOT_COLUMNS:
+            section = _SectionWriter(output)
+            for row in store.export_rows(table, project_id):
+                section.write_row(row)
+            index['sections'][table] = section.close()
+
+        section = _SectionWriter(output)
+        for contributor in contributors:
+            section.write_row([contributor['username'], contributor['name'], len(contributor['timeline']),
+                               *(contributor[action] for action in ACTIONS)])
+        index['sections']['contributors'] = section.close()
+
+        # Timelines are stored as their raw arrays: every timestamp, then every action code
+        section = _SectionWriter(output)
+        for contributor in contributors:
+            section.write(contributor['timeline'].timestamps.tobytes())
+        for contributor in contributors:
+            section.write(contributor['timeline'].actions.tobytes())
+        index['sections']['timelines'] = section.close()
+
+        encoded_index = json.dumps(index).encode()
+        output.write(encoded_index)
+        output.write(TRAILER.pack(len(encoded_index), MAGIC))
+    os.replace(temporary_path, path)
+    logger.info(f"Wrote snapshot of project {project_id} to {path} ({os.path.getsize(path)} bytes)")
+    return index
+
+class Snapshot:
+    """
+    A snapshot file opened for reading. Only the index is parsed on open; sections
+    are decompressed from the memory-mapped file as they are read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self._mmap) < len(MAGIC) + TRAILER.size or self._mmap[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{path} is not a snapshot file')
+            index_length, magic = TRAILER.unpack(self._mmap[-TRAILER.size:])
+            if magic != MAGIC:
+                raise ValueError(f'{path} is truncated')
+            index_end = len(self._mmap) - TRAILER.size
+            self.index = json.loads(self._mmap[index_end - index_length:index_end])
+        except Exception:
+            self.close()
+            raise
+        if self.index['version'] != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported snapshot version {self.index['version']}")
+
+    def close(self):
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _chunks(self, name):
+        section = self.index['sections'][name]
+        decompressor = zlib.decompressobj()
+        end = section['offset'] + section['length']
+        for start in range(section['offset'], end, CHUNK_SIZE):
+            yield decompressor.decompress(self._mmap[start:min(start + CHUNK_SIZE, end)])
+        yield decompressor.flush()
+
+    def rows(self, name):
+        """
+        Streams the rows of a section without decompressing it as a whole
+        :param name: Section name, a store table or 'contributors'
+        :return: Generator of row lists
+        """
+        pending = b''
+        for chunk in self._chunks(name):
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield loads(line)
+        if pending:
+            yield loads(pending)
+
+    def contributors(self):
+        """
+        Rebuilds the contributor aggregates
+        :return: List of contributor dictionaries with sorted Timelines
+        """
+        if tuple(self.index['actions']) != ACTIONS:
+            raise ValueError(f"Snapshot timelines use the actions {self.index['actions']}, expected {ACTIONS}")
+        entries = list(self.rows('contributors'))
+        data = b''.join(self._chunks('timelines'))
+        total = sum(entry[2] for entry in entries)
+        timestamps = array('q', data[:8 * total])
+        actions = array('B', data[8 * total:])
+        if self.index['byteorder'] != sys.byteorder:
+            timestamps.byteswap()
+        contributors = []
+        position = 0
+        for username, name, events, *counts in entries:
+            timeline = Timeline()
+            timeline.timestamps = timestamps[position:position + events]
+            timeline.actions = actions[position:position + events]
+            position += events
+            contributors.append({'username': username, 'name': name, **dict(zip(self.index['actions'], counts)), 'timeline': timeline})
+        return contributors
+
+    def load_into_store(self, store=None):
+        """
+        Replaces the project's stored state with the snapshot's
+        :param store: MergeRequestStore, defaults to the shared store
+        :return: Dictionary of table -> number of imported rows
+        """
+        store = store or get_store()
+        return store.import_project(
+            self.index['project_id'],
+            self.index['watermark'],
+            {table: self.rows(table) for table in SNAPSHOT_COLUMNS},
+        )
+
+def load_snapshot(path, store=None, force=False):
+    """
+    Imports a snapshot into the store unless the store already holds the project at the
+    same or a newer watermark, or a first sync of the project is under way. The leaderboards
+    are materialized from the snapshot's contributor aggregates after an import, and otherwise
+    from the store, which is newer. Blocking; from the event loop run it through store.run().
+    :param path: Snapshot file
+    :param store: MergeRequestStore, defaults to the shared store
+    :param force: Import even when the store is as recent as the snapshot
+    :return: Snapshot index with the imported row counts under 'imported' (empty when skipped)
+    """
+    store = store or get_store()
+    with Snapshot(path) as snapshot:
+        index = snapshot.index
+        stored_watermark = store.get_watermark(index['project_id'])
+        # Merge requests without a watermark belong to a sync that hasn't finished; importing
+        # would drop them while the sync still advances the watermark past them
+        syncing = stored_watermark is None and store.list_merge_requests(index['project_id'], limit=1)
+        imported = {}
+        if force or (not syncing and (stored_watermark is None or stored_watermark < index['watermark'])):
+            imported = snapshot.load_into_store(store)
+            contributors = snapshot.contributors()
+        else:
+            contributors = get_stored_contributors(index['project_id'], store=store)
+        if index['repository_url']:
+            materialize_leaderboards(index['repository_url'], contributors)
+    logger.info(f"Loaded snapshot {path} of project {index['project_id']}: "
+                f"{sum(imported.values()) if imported else 'store already current,'} rows imported")
+    return {**index, 'imported': imported}
+
+async def load_snapshot_dir(directory=None):
+    """
+    Loads every *.snap file of a directory, logging and skipping the ones that fail.
+    Each snapshot is imported on the store's thread, so the server keeps answering
+    meanwhile; leaderboards of projects not loaded yet are missing until a scan
+    or their snapshot provides them.
+    :param directory: Directory to read, defaults to GITLAB_SNAPSHOT_DIR
+    :return: Number of loaded snapshots
+    """
+    directory = directory or GITLAB_SNAPSHOT_DIR
+    if not directory or not os.path.isdir(directory):
+        return 0
+    store = get_store()
+    loaded = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.snap'):
+            continue
+        try:
+            await store.run(load_snapshot, os.path.join(directory, name), store)
+            loaded += 1
+        except Exception as error:
+            logger.error(f"Error loading snapshot {name}: {str(error)}")
+    return loaded
+
+async def dump_snapshot(repository_url, path):
+    """
+    Syncs a project into the store and writes its snapshot
+    :param repository_url: URL of the GitLab repository
+    :param path: Snapshot file to write
+    :return: Snapshot index dictionary
+    """
+    try:
+        project_id = await get_project_id(repository_url)
+        contributors, _ = await get_all_contributors(project_id, repository_url)
+        store = get_store()
+        return await store.run(write_snapshot, path, project_id, repository_url, contributors, store)
+    finally:
+        await close_client()
+
+def main():
+    parser = argparse.ArgumentParser(description='Dump and load snapshots of the scan state of GitLab projects')
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('dump', help='Sync a project and write its snapshot')
+    dump.add_argument('repository_url')
+    dump.add_argument('path')
+    load = commands.add_parser('load', help='Import snapshots into the store')
+    load.add_argument('paths', nargs='+')
+    load.add_argument('--force', action='store_true', help='Import even when the store is as recent as the snapshot')
+    info = commands.add_parser('info', help='Show the index of a snapshot')
+    info.add_argument('path')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'dump':
+        index = asyncio.run(dump_snapshot(args.repository_url, args.path))
+        print(json.dumps(index['sections'], indent=2))
+    elif args.command == 'load':
+        for path in args.paths:
+            index = load_snapshot(path, force=args.force)
+            print(f"{path}: project {index['project_id']}, imported {index['imported'] or 'nothing, store already current'}")
+    else:
+        with Snapshot(args.path) as snapshot:
+            print(json.dumps(snapshot.index, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,517 @@
+import os
+import json
+import sqlite3
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from aggregation import loads
+
+GITLAB_STORE_PATH = os.environ.get('GITLAB_STORE_PATH', 'gitlab_store.db')
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS merge_requests (
+    project_id INTEGER NOT NULL,
+    iid INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    activity_synced_at TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, iid)
+);
+CREATE INDEX IF NOT EXISTS merge_requests_created_at ON merge_requests (project_id, created_at);
+
+CREATE TABLE IF NOT EXISTS notes (
+    project_id INTEGER NOT NULL,
+    mr_iid INTEGER NOT NULL,
+    note_id INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, note_id)
+);
+CREATE INDEX IF NOT EXISTS notes_mr ON notes (project_id, mr_iid);
+
+CREATE TABLE IF NOT EXISTS award_emoji (
+    project_id INTEGER NOT NULL,
+    mr_iid INTEGER NOT NULL,
+    note_id INTEGER NOT NULL,
+    emoji_id INTEGER,
+    name TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (project_id, note_id, username, name)
+);
+CREATE INDEX IF NOT EXISTS award_emoji_mr ON award_emoji (project_id, mr_iid);
+
+CREATE TABLE IF NOT EXISTS commits (
+    project_id INTEGER NOT NULL,
+    mr_iid INTEGER NOT NULL,
+    sha TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    created_at TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, mr_iid, sha)
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    project_id INTEGER PRIMARY KEY,
+    watermark TEXT
+);
+"""
+
+# Columns of each table that snapshots carry, besides project_id
+SNAPSHOT_COLUMNS = {
+    'merge_requests': ('iid', 'state', 'created_at', 'updated_at', 'activity_synced_at', 'data'),
+    'notes': ('mr_iid', 'note_id', 'author', 'created_at', 'data'),
+    'award_emoji': ('mr_iid', 'note_id', 'emoji_id', 'name', 'username'),
+    'commits': ('mr_iid', 'sha', 'author_name', 'created_at', 'data'),
+}
+
+class MergeRequestStore:
+    """
+    Local SQLite copy of merge requests, notes, award emoji and commits per project.
+    A merge request's notes and commits are considered stale whenever its
+    updated_at differs from the updated_at they were last fetched for.
+    The methods are blocking; code on the event loop calls them through run(),
+    which executes them one at a time on the store's own thread.
+    """
+
+    def __init__(self, path=GITLAB_STORE_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='store')
+        self._versions = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self._migrate_award_emoji()
+        logger.info(f"Opened merge request store at {path}")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.connection.close()
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Runs a store method, or any function using the store, on the store's thread so that
+        SQLite reads and writes don't block the event loop
+        :param function: Callable, e.g. store.get_watermark
+        :return: The function's return value
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+
+    def version(self, project_id):
+        """
+        Returns a counter that changes whenever merge requests or activity of the project are
+        written, so that totals tallied from the store can tell whether they are still current.
+        It is kept in memory and only covers writes made through this store.
+        :param project_id: ID of the GitLab project
+        :return: Integer version
+        """
+        return self._versions.get(project_id, 0)
+
+    def _changed(self, project_id):
+        self._versions[project_id] = self._versions.get(project_id, 0) + 1
+
+    def _migrate_award_emoji(self):
+        """
+        Rekeys award emoji stored by earlier versions on their emoji ID to (note, user, name),
+        the only key that both webhooks and GraphQL provide, merging duplicates
+        """
+        key = [row['name'] for row in self.connection.execute('PRAGMA table_info(award_emoji)') if row['pk']]
+        if 'emoji_id' not in key:
+            return
+        with self.connection:
+            self.connection.execute('ALTER TABLE award_emoji RENAME TO award_emoji_old')
+            self.connection.execute('DROP INDEX IF EXISTS award_emoji_mr')
+        self.connection.executescript(SCHEMA)
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO award_emoji (project_id, mr_iid, note_id, emoji_id, name, username) '
+                "SELECT project_id, mr_iid, note_id, emoji_id, COALESCE(name, ''), username FROM award_emoji_old"
+            )
+            self.connection.execute('DROP TABLE award_emoji_old')
+        logger.info("Migrated award emoji to be keyed by note, user and name")
+
+    def get_watermark(self, project_id):
+        """
+        Returns the updated_at of the newest merge request synced for the project
+        :param project_id: ID of the GitLab project
+        :return: ISO timestamp or None if the project has never been synced
+        """
+        row = self.connection.execute(
+            'SELECT watermark FROM sync_state WHERE project_id = ?', (project_id,)
+        ).fetchone()
+        return row['watermark'] if row else None
+
+    def set_watermark(self, project_id, watermark):
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO sync_state (project_id, watermark) VALUES (?, ?) '
+                'ON CONFLICT (project_id) DO UPDATE SET watermark = excluded.watermark',
+                (project_id, watermark)
+            )
+
+    def upsert_merge_requests(self, project_id, merge_requests):
+        """
+        Inserts or updates merge requests, keeping their activity sync marker
+        :param project_id: ID of the GitLab project
+        :param merge_requests: List of merge request dictionaries from the GitLab API
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO merge_requests (project_id, iid, state, created_at, updated_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (project_id, iid) DO UPDATE SET state = excluded.state, '
+                'updated_at = excluded.updated_at, data = excluded.data',
+                [
+                    (project_id, mr['iid'], mr['state'], mr['created_at'], mr['updated_at'], json.dumps(mr))
+                    for mr in merge_requests
+                ]
+            )
+        if merge_requests:
+            self._changed(project_id)
+
+    def get_merge_request(self, project_id, iid):
+        """
+        Returns a stored merge request
+        :param project_id: ID of the GitLab project
+        :param iid: IID of the merge request
+        :return: Merge request dictionary or None if it is not stored
+        """
+        row = self.connection.execute(
+            'SELECT data FROM merge_requests WHERE project_id = ? AND iid = ?', (project_id, iid)
+        ).fetchone()
+        return loads(row['data']) if row else None
+
+    def synced_projects(self):
+        """
+        Lists the projects that have been synced at least once
+        :return: List of project IDs
+        """
+        return [row['project_id'] for row in self.connection.execute('SELECT project_id FROM sync_state')]
+
+    def add_note(self, project_id, mr_iid, note):
+        """
+        Stores a single note unless it is already stored, e.g. when it arrives through a webhook
+        :param project_id: ID of the GitLab project
+        :param mr_iid: IID of the merge request
+        :param note: Note dictionary in the shape of the GitLab API
+        :return: True if the note was added, False if it was already stored
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO notes (project_id, mr_iid, note_id, author, created_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (project_id, mr_iid, note['id'], note['author']['username'], note['created_at'], json.dumps(note))
+            )
+        if cursor.rowcount == 1:
+            self._changed(project_id)
+        return cursor.rowcount == 1
+
+    def add_award_emoji(self, project_id, mr_iid, note_id, emoji):
+        """
+        Stores a single award emoji of a note unless the user already awarded it
+        :param project_id: ID of the GitLab project
+        :param mr_iid: IID of the merge request
+        :param note_id: ID of the awarded note
+        :param emoji: Award emoji dictionary with 'name', 'user' and optionally 'id'
+        :return: True if the award emoji was added, False if it was already stored
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO award_emoji (project_id, mr_iid, note_id, emoji_id, name, username) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (project_id, mr_iid, note_id, emoji.get('id'), emoji.get('name') or '', emoji['user']['username'])
+            )
+        if cursor.rowcount == 1:
+            self._changed(project_id)
+        return cursor.rowcount == 1
+
+    def remove_award_emoji(self, project_id, note_id, username, name):
+        """
+        Removes a revoked award emoji
+        :param project_id: ID of the GitLab project
+        :param note_id: ID of the awarded note
+        :param username: User who revoked the award emoji
+        :param name: Name of the award emoji, e.g. 'thumbsup'
+        :return: True if the award emoji was stored
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM award_emoji WHERE project_id = ? AND note_id = ? AND username = ? AND name = ?',
+                (project_id, note_id, username, name or '')
+            )
+        if cursor.rowcount == 1:
+            self._changed(project_id)
+        return cursor.rowcount == 1
+
+    def export_rows(self, table, project_id):
+        """
+        Iterates over the raw rows of a project in one table, for snapshots
+        :param table: One of SNAPSHOT_COLUMNS
+        :param project_id: ID of the GitLab project
+        :return: Cursor yielding tuples in the column order of SNAPSHOT_COLUMNS[table]
+        """
+        columns = SNAPSHOT_COLUMNS[table]
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE project_id = ?", (project_id,)
+        )
+        cursor.row_factory = None
+        return cursor
+
+    def import_project(self, project_id, watermark, tables):
+        """
+        Replaces everything stored for a project in one transaction, e.g. from a snapshot
+        :param project_id: ID of the GitLab project
+        :param watermark: Sync watermark of the imported data
+        :param tables: Dictionary of table -> iterable of rows in the column order of SNAPSHOT_COLUMNS[table]
+        :return: Dictionary of table -> number of imported rows
+        """
+        counts = {}
+        with self.connection:
+            for table, columns in SNAPSHOT_COLUMNS.items():
+                self.connection.execute(f'DELETE FROM {table} WHERE project_id = ?', (project_id,))
+                cursor = self.connection.executemany(
+                    f"INSERT INTO {table} (project_id, {', '.join(columns)}) "
+                    f"VALUES (?, {', '.join('?' for _ in columns)})",
+                    ((project_id, *row) for row in tables.get(table, ()))
+                )
+                counts[table] = cursor.rowcount
+            self.connection.execute(
+                'INSERT INTO sync_state (project_id, watermark) VALUES (?, ?) '
+                'ON CONFLICT (project_id) DO UPDATE SET watermark = excluded.watermark',
+                (project_id, watermark)
+            )
+        self._changed(project_id)
+        return counts
+
+    def stale_merge_requests(self, project_id, iids=None):
+        """
+        Lists merge requests whose notes and commits need to be (re)fetched
+        :param project_id: ID of the GitLab project
+        :param iids: Optional list of IIDs to restrict the check to
+        :return: List of (iid, updated_at) tuples
+        """
+        query = (
+            'SELECT iid, updated_at FROM merge_requests WHERE project_id = ? '
+            'AND (activity_synced_at IS NULL OR activity_synced_at != updated_at)'
+        )
+        if iids is None:
+            rows = self.connection.execute(query, (project_id,)).fetchall()
+        else:
+            rows = []
+            iids = list(iids)
+            for start in range(0, len(iids), 500):
+                chunk = iids[start:start + 500]
+                rows.extend(self.connection.execute(
+                    query + f" AND iid IN ({', '.join('?' for _ in chunk)})", [project_id, *chunk]
+                ))
+        return [(row['iid'], row['updated_at']) for row in rows]
+
+    def replace_activity(self, project_id, mr_iid, updated_at, notes, commits):
+        """
+        Replaces the stored notes, award emoji and commits of a merge request.
+        The award emoji of a note are only replaced when the note carries an 'award_emoji'
+        list: REST notes don't, so reactions received through webhooks are kept for them.
+        :param project_id: ID of the GitLab project
+        :param mr_iid: IID of the merge request
+        :param updated_at: updated_at of the merge request the activity was fetched for
+        :param notes: List of note dictionaries from the GitLab API
+        :param commits: List of commit dictionaries from the GitLab API
+        """
+        kept_emoji_notes = {note['id'] for note in notes if 'award_emoji' not in note}
+        with self.connection:
+            stored_emoji_notes = {row['note_id'] for row in self.connection.execute(
+                'SELECT DISTINCT note_id FROM award_emoji WHERE project_id = ? AND mr_iid = ?', (project_id, mr_iid)
+            )}
+            self.connection.executemany(
+                'DELETE FROM award_emoji WHERE project_id = ? AND note_id = ?',
+                [(project_id, note_id) for note_id in stored_emoji_notes - kept_emoji_notes]
+            )
+            for table in ('notes', 'commits'):
+                self.connection.execute(
+                    f'DELETE FROM {table} WHERE project_id = ? AND mr_iid = ?', (project_id, mr_iid)
+                )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO notes (project_id, mr_iid, note_id, author, created_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (project_id, mr_iid, note['id'], note['author']['username'], note['created_at'], json.dumps(note))
+                    for note in notes
+                ]
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO award_emoji (project_id, mr_iid, note_id, emoji_id, name, username) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (project_id, mr_iid, note['id'], emoji.get('id'), emoji.get('name') or '', emoji['user']['username'])
+                    for note in notes
+                    for emoji in note.get('award_emoji', [])
+                ]
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO commits (project_id, mr_iid, sha, author_name, created_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (project_id, mr_iid, commit['id'], commit['author_name'], commit.get('created_at'), json.dumps(commit))
+                    for commit in commits
+                ]
+            )
+            self.connection.execute(
+                'UPDATE merge_requests SET activity_synced_at = ? WHERE project_id = ? AND iid = ?',
+                (updated_at, project_id, mr_iid)
+            )
+        self._changed(project_id)
+
+    def list_merge_requests(self, project_id, states=None, created_after=None, limit=None):
+        """
+        Lists stored merge requests, newest first
+        :param project_id: ID of the GitLab project
+        :param states: Optional list of states to include
+        :param created_after: Optional ISO timestamp; older merge requests are excluded
+        :param limit: Optional maximum number of merge requests
+        :return: List of merge request dictionaries
+        """
+        return list(self.iter_merge_requests(project_id, states, created_after, limit))
+
+    def iter_merge_requests(self, project_id, states=None, created_after=None, limit=None, batch_size=500):
+        """
+        Iterates over stored merge requests, newest first, decoding them batch by batch
+        :param project_id: ID of the GitLab project
+        :param states: Optional list of states to include
+        :param created_after: Optional ISO timestamp; older merge requests are excluded
+        :param limit: Optional maximum number of merge requests
+        :param batch_size: Number of rows fetched from SQLite at a time
+        :return: Generator of merge request dictionaries
+        """
+        for batch in self.iter_merge_request_batches(project_id, states, created_after, limit, batch_size):
+            yield from batch
+
+    def iter_merge_request_batches(self, project_id, states=None, created_after=None, limit=None, batch_size=500):
+        """
+        Like iter_merge_requests, but yields lists of up to batch_size decoded merge requests,
+        so that each batch can be read with one run(next, batches, None) call
+        :return: Generator of lists of merge request dictionaries
+        """
+        query = 'SELECT data FROM merge_requests WHERE project_id = ?'
+        params = [project_id]
+        if states:
+            query += f" AND state IN ({', '.join('?' for _ in states)})"
+            params.extend(states)
+        if created_after:
+            query += ' AND created_at >= ?'
+            params.append(created_after)
+        query += ' ORDER BY created_at DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        cursor = self.connection.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [loads(row['data']) for row in rows]
+
+    def get_activity(self, project_id, mr_iids=None):
+        """
+        Returns the stored notes (with their award emoji) and commits grouped by merge request
+        :param project_id: ID of the GitLab project
+        :param mr_iids: Optional list of IIDs to restrict the result to
+        :return: Dictionary of iid -> (notes, commits)
+        """
+        if mr_iids is None:
+            return self._load_activity(project_id, '', [])
+        activity = {}
+        mr_iids = list(mr_iids)
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(mr_iids), 500):
+            chunk = mr_iids[start:start + 500]
+            clause = f" AND mr_iid IN ({', '.join('?' for _ in chunk)})"
+            activity.update(self._load_activity(project_id, clause, chunk))
+        return activity
+
+    def get_raw_activity(self, project_id, mr_iids=None):
+        """
+        Returns stored merge requests of a project with their activity, undecoded,
+        for tallying in worker processes
+        :param project_id: ID of the GitLab project
+        :param mr_iids: Optional list of IIDs to restrict the result to
+        :return: Dictionary of iid -> (merge request JSON, [(note ID, note JSON)], {note ID: [reactor usernames]}, [commit author names])
+        """
+        if mr_iids is None:
+            return self._load_raw_activity(project_id, '', '', [])
+        activity = {}
+        mr_iids = list(mr_iids)
+        for start in range(0, len(mr_iids), 500):
+            chunk = mr_iids[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            activity.update(self._load_raw_activity(
+                project_id, f' AND iid IN ({placeholders})', f' AND mr_iid IN ({placeholders})', chunk
+            ))
+        return activity
+
+    def _load_raw_activity(self, project_id, mr_clause, clause, params):
+        activity = {}
+        for row in self.connection.execute(
+            f'SELECT iid, data FROM merge_requests WHERE project_id = ?{mr_clause}', [project_id, *params]
+        ):
+            activity[row['iid']] = (row['data'], [], {}, [])
+        for row in self.connection.execute(
+            f'SELECT mr_iid, note_id, data FROM notes WHERE project_id = ?{clause} ORDER BY mr_iid, created_at',
+            [project_id, *params]
+        ):
+            if row['mr_iid'] in activity:
+                activity[row['mr_iid']][1].append((row['note_id'], row['data']))
+        for row in self.connection.execute(
+            f'SELECT mr_iid, note_id, username FROM award_emoji WHERE project_id = ?{clause}', [project_id, *params]
+        ):
+            if row['mr_iid'] in activity:
+                activity[row['mr_iid']][2].setdefault(row['note_id'], []).append(row['username'])
+        for row in self.connection.execute(
+            f'SELECT mr_iid, author_name FROM commits WHERE project_id = ?{clause}', [project_id, *params]
+        ):
+            if row['mr_iid'] in activity:
+                activity[row['mr_iid']][3].append(row['author_name'])
+        return activity
+
+    def _load_activity(self, project_id, clause, params):
+        activity = {}
+        emoji_by_note = {}
+        for row in self.connection.execute(
+            f'SELECT note_id, emoji_id, name, username FROM award_emoji WHERE project_id = ?{clause}',
+            [project_id, *params]
+        ):
+            emoji_by_note.setdefault(row['note_id'], []).append(
+                {'id': row['emoji_id'], 'name': row['name'], 'user': {'username': row['username']}}
+            )
+        for row in self.connection.execute(
+            f'SELECT mr_iid, note_id, data FROM notes WHERE project_id = ?{clause} ORDER BY mr_iid, created_at',
+            [project_id, *params]
+        ):
+            note = loads(row['data'])
+            note['award_emoji'] = emoji_by_note.get(row['note_id'], [])
+            activity.setdefault(row['mr_iid'], ([], []))[0].append(note)
+        for row in self.connection.execute(
+            f'SELECT mr_iid, data FROM commits WHERE project_id = ?{clause}',
+            [project_id, *params]
+        ):
+            activity.setdefault(row['mr_iid'], ([], []))[1].append(loads(row['data']))
+        return activity
+
+_store = None
+
+def get_store():
+    """
+    Returns the shared merge request store, opening it on first use
+    :return: MergeRequestStore
+    """
+    global _store
+    if _store is None:
+        _store = MergeRequestStore()
+    return _store
@@ -0,0 +1,132 @@
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+ACTIONS = ('opened', 'committed', 'commented', 'reacted')
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+BUCKETS = ('day', 'week', 'month')
+
+class Timeline:
+    """
+    Compact per-contributor event log: epoch seconds and action codes kept in
+    two parallel arrays instead of one dictionary per event
+    """
+    __slots__ = ('timestamps', 'actions')
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.actions = array('B')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, action):
+        """
+        Records an event
+        :param timestamp: Epoch seconds of the event
+        :param action: One of ACTIONS
+        """
+        self.timestamps.append(timestamp)
+        self.actions.append(ACTION_CODES[action])
+
+    def extend(self, other):
+        """
+        Appends all events of another timeline
+        :param other: Timeline to copy events from
+        """
+        self.timestamps.extend(other.timestamps)
+        self.actions.extend(other.actions)
+
+    def remove(self, other):
+        """
+        Removes one occurrence of each event of another timeline
+        :param other: Timeline whose events are removed
+        """
+        pending = Counter(zip(other.timestamps, other.actions))
+        timestamps = array('q')
+        actions = array('B')
+        for timestamp, code in zip(self.timestamps, self.actions):
+            if pending[(timestamp, code)] > 0:
+                pending[(timestamp, code)] -= 1
+            else:
+                timestamps.append(timestamp)
+                actions.append(code)
+        self.timestamps = timestamps
+        self.actions = actions
+
+    def sort(self):
+        """
+        Orders the events chronologically
+        """
+        order = sorted(range(len(self.timestamps)), key=self.timestamps.__getitem__)
+        self.timestamps = array('q', (self.timestamps[i] for i in order))
+        self.actions = array('B', (self.actions[i] for i in order))
+
+    def to_columns(self):
+        """
+        Returns the raw events in columnar form
+        :return: Dictionary with 'timestamps' (epoch seconds) and 'actions' (indexes into ACTIONS)
+        """
+        return {'timestamps': self.timestamps.tolist(), 'actions': self.actions.tolist()}
+
+    def histogram(self, bucket):
+        """
+        Counts events per action in day, week or month buckets
+        :param bucket: One of BUCKETS
+        :return: Dictionary with the sorted bucket labels and one aligned count series per action
+        """
+        counts = {}
+        for timestamp, code in zip(self.timestamps, self.actions):
+            label = bucket_label(timestamp, bucket)
+            if label not in counts:
+                counts[label] = [0] * len(ACTIONS)
+            counts[label][code] += 1
+        labels = sorted(counts)
+        series = {action: [counts[label][code] for label in labels] for code, action in enumerate(ACTIONS)}
+        return {'buckets': labels, **series}
+
+def to_timestamp(value):
+    """
+    Converts a GitLab ISO 8601 timestamp to epoch seconds
+    :param value: Timestamp string such as '2024-01-31T12:00:00.000Z'
+    :return: Integer epoch seconds
+    """
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+def bucket_label(timestamp, bucket):
+    """
+    Returns the label of the bucket an epoch timestamp falls into
+    :param timestamp: Epoch seconds
+    :param bucket: 'day' (YYYY-MM-DD), 'week' (YYYY-MM-DD of the Monday) or 'month' (YYYY-MM)
+    :return: Bucket label
+    """
+    date = datetime.fromtimestamp(timestamp, tz=timezone.utc).date()
+    if bucket == 'day':
+        return date.isoformat()
+    if bucket == 'week':
+        return (date - timedelta(days=date.weekday())).isoformat()
+    if bucket == 'month':
+        return date.strftime('%Y-%m')
+    raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+
+def format_contributors(contributors, bucket=None, events=False):
+    """
+    Prepares contributors for an API response. Timelines are replaced by a
+    histogram when a bucket is given and by the raw columnar events when
+    requested; otherwise they are left out.
+    :param contributors: List of contributor dictionaries holding Timeline objects
+    :param bucket: Optional histogram bucket, one of BUCKETS
+    :param events: Include the raw events
+    :return: List of JSON-serializable contributor dictionaries
+    """
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+    formatted = []
+    for contributor in contributors:
+        data = {key: value for key, value in contributor.items() if key != 'timeline'}
+        if bucket is not None:
+            data['histogram'] = contributor['timeline'].histogram(bucket)
+        if events:
+            data['timeline'] = contributor['timeline'].to_columns()
+        formatted.append(data)
+    return formatted
@@ -0,0 +1,413 @@
+import os
+import hmac
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from gitlab_client import gitlab_get
+from store import get_store
+from timeline import to_timestamp
+from metrics import Counter, Gauge, Histogram
+from leaderboard import materialize_leaderboards, leaderboard_keys
+from aggregation import merge_contributors, subtract_contributors, tally_in_pool, tally_merge_requests
+from gitlab_scanner import get_project_path, contributor_list, sync_merge_requests, sync_merge_request_activity
+
+GITLAB_WEBHOOK_SECRET = os.environ.get('GITLAB_WEBHOOK_SECRET')
+GITLAB_WEBHOOK_QUEUE_SIZE = int(os.environ.get('GITLAB_WEBHOOK_QUEUE_SIZE', 10000))
+# Longest time leaderboards may lag behind during a sustained burst of events
+GITLAB_WEBHOOK_REFRESH_INTERVAL = float(os.environ.get('GITLAB_WEBHOOK_REFRESH_INTERVAL', 5))
+# Seconds between reconciliation syncs of every stored project, 0 disables them
+GITLAB_RECONCILE_INTERVAL = float(os.environ.get('GITLAB_RECONCILE_INTERVAL', 900))
+
+# X-Gitlab-Event header -> object_kind of the payload
+WEBHOOK_EVENTS = {
+    'Merge Request Hook': 'merge_request',
+    'Note Hook': 'note',
+    'Emoji Hook': 'emoji',
+}
+
+WEBHOOK_EVENTS_TOTAL = Counter('gitlab_scanner_webhook_events_total', 'Webhook events by kind and outcome', ('kind', 'result'))
+WEBHOOK_LAG = Histogram('gitlab_scanner_webhook_lag_seconds', 'Time from receiving a webhook event until it is applied to the store')
+WEBHOOK_QUEUE_SIZE = Gauge('gitlab_scanner_webhook_queue_size', 'Webhook events waiting to be applied', collect=lambda: {
+    (): webhook_processor.queue.qsize() if webhook_processor.queue is not None else 0
+})
+
+logger = logging.getLogger(__name__)
+
+class WebhookProcessor:
+    """
+    Applies GitLab Merge Request, Note and Emoji hook events to the local store
+    from a queue, so that bursts are absorbed without blocking GitLab's
+    requests. Events are idempotent: notes are keyed by their GitLab IDs, award
+    emoji by note, user and name, and a merge request is only refetched when the event is newer
+    than the stored copy. Each project's contributor totals are tallied from
+    the store once and then updated per event by swapping the affected merge
+    request's earlier contribution for its current one. The totals carry the
+    store version they match and are tallied again once anything else, such as
+    a scan or a reconciliation sync, has written to the project. After the queue
+    drains, and at least every GITLAB_WEBHOOK_REFRESH_INTERVAL during a burst,
+    the leaderboards of the changed projects are ranked from these totals.
+    A periodic reconciliation sync catches events that never arrived.
+    """
+
+    def __init__(self, maxsize=GITLAB_WEBHOOK_QUEUE_SIZE, reconcile_interval=GITLAB_RECONCILE_INTERVAL):
+        self.maxsize = maxsize
+        self.reconcile_interval = reconcile_interval
+        self.queue = None
+        self.counts = {}
+        self.last_event_at = None
+        self.last_refresh_at = None
+        self.last_reconcile = None
+        self._dirty = set()
+        self._missed = set()
+        self._paths = {}
+        self._aggregates = {}
+        self._tasks = []
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def start(self):
+        """
+        Starts the worker and, unless disabled, the reconciliation loop. Must be called from the event loop.
+        """
+        if self.running:
+            return
+        self.queue = asyncio.Queue(self.maxsize)
+        self._tasks.append(asyncio.create_task(self._work()))
+        if self.reconcile_interval > 0:
+            self._tasks.append(asyncio.create_task(self._reconcile_periodically()))
+        logger.info(f"Started webhook processor, reconciling every {self.reconcile_interval:.0f}s")
+
+    async def stop(self):
+        """
+        Cancels the worker and the reconciliation loop. Queued events are dropped; reconciliation picks them up after a restart.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, kind, payload):
+        """
+        Queues an event for the worker
+        :param kind: object_kind of the event, one of WEBHOOK_EVENTS' values
+        :param payload: Decoded webhook payload
+        :return: True if the event was queued, False if the queue was full
+        :raises: Exception if the processor is not running
+        """
+        if not self.running:
+            raise Exception('Webhook processor is not running')
+        self.last_event_at = time.time()
+        try:
+            self.queue.put_nowait((kind, payload, time.perf_counter()))
+            return True
+        except asyncio.QueueFull:
+            # Dropping is safe: the project is synced at the next reconciliation
+            project_id = payload.get('project', {}).get('id')
+            if project_id is not None:
+                self._missed.add(project_id)
+            self._count(kind, 'dropped')
+            logger.error(f"Webhook queue full, dropped {kind} event of project {project_id}")
+            return False
+
+    def _count(self, kind, result):
+        self.counts[result] = self.counts.get(result, 0) + 1
+        WEBHOOK_EVENTS_TOTAL.inc(kind=kind, result=result)
+
+    async def _work(self):
+        while True:
+            kind, payload, received = await self.queue.get()
+            try:
+                changed = await self.apply(kind, payload)
+                self._count(kind, 'applied' if changed else 'duplicate')
+            except Exception as error:
+                project_id = payload.get('project', {}).get('id')
+                if project_id is not None:
+                    self._missed.add(project_id)
+                self._count(kind, 'failed')
+                logger.error(f"Error applying {kind} event of project {project_id}: {str(error)}")
+            finally:
+                self.queue.task_done()
+            WEBHOOK_LAG.observe(time.perf_counter() - received)
+            # Coalesce a burst into one refresh, but don't let the leaderboards fall too far behind
+            if self._dirty and (self.queue.empty() or time.time() - (self.last_refresh_at or 0) >= GITLAB_WEBHOOK_REFRESH_INTERVAL):
+                await self.refresh()
+
+    async def apply(self, kind, payload):
+        """
+        Applies one event to the store
+        :param kind: object_kind of the event
+        :param payload: Decoded webhook payload
+        :return: True if the store changed, False for duplicates and events that don't affect contributors
+        """
+        project = payload['project']
+        project_id = project['id']
+        self._paths[project_id] = project['path_with_namespace']
+        mr_iid = _merge_request_iid(kind, payload)
+        # GitLab is called first; the store write then runs on the store's thread together with
+        # the tallies of the merge request before and after it, so nothing else writes in between
+        if kind == 'merge_request':
+            write = await self._apply_merge_request(project_id, payload)
+        elif kind == 'note':
+            write = await self._apply_note(project_id, payload)
+        elif kind == 'emoji':
+            write = await self._apply_emoji(project_id, payload)
+        else:
+            raise ValueError(f"Unsupported webhook event: {kind}")
+        if write is None:
+            return False
+        store = get_store()
+        tally = mr_iid is not None and project_id in self._aggregates
+        changed, before, after, version_before, version_after = await store.run(
+            _write_and_tally, store, project_id, mr_iid, write, tally
+        )
+        if changed:
+            self._dirty.add(project_id)
+        entry = self._aggregates.get(project_id)
+        if entry is not None:
+            version, aggregate = entry
+            if changed and before is not None and version == version_before:
+                subtract_contributors(aggregate, before)
+                merge_contributors(aggregate, after)
+                self._aggregates[project_id] = (version_after, aggregate)
+            elif version != version_after:
+                # The totals missed a write made elsewhere, e.g. by a scan; they are tallied again on refresh
+                del self._aggregates[project_id]
+        return changed
+
+    async def _apply_merge_request(self, project_id, payload):
+        attributes = payload['object_attributes']
+        store = get_store()
+        stored = await store.run(store.get_merge_request, project_id, attributes['iid'])
+        if stored is not None and to_timestamp(stored['updated_at']) >= to_timestamp(_iso(attributes['updated_at'])):
+            return None
+        # The payload only carries the author's ID, so the merge request is read back in its API shape
+        merge_request = await self._fetch_merge_request(project_id, attributes['iid'])
+
+        def write(store):
+            store.upsert_merge_requests(project_id, [merge_request])
+            return True
+        return write
+
+    async def _apply_note(self, project_id, payload):
+        attributes = payload['object_attributes']
+        if attributes.get('noteable_type') != 'MergeRequest':
+            return None
+        mr_iid = payload['merge_request']['iid']
+        merge_request = await self._missing_merge_request(project_id, mr_iid)
+        user = payload['user']
+        note = {
+            'id': attributes['id'],
+            'body': attributes.get('note'),
+            'system': attributes.get('system') or False,
+            'created_at': _iso(attributes['created_at']),
+            'author': {'id': user.get('id'), 'username': user['username'], 'name': user.get('name')},
+        }
+
+        def write(store):
+            if merge_request is not None:
+                store.upsert_merge_requests(project_id, [merge_request])
+            return store.add_note(project_id, mr_iid, note) or merge_request is not None
+        return write
+
+    async def _apply_emoji(self, project_id, payload):
+        attributes = payload['object_attributes']
+        # Reactions are counted on merge request comments only, like in a full scan
+        note = payload.get('note')
+        if attributes.get('awardable_type') != 'Note' or not note or 'merge_request' not in payload:
+            return None
+        mr_iid = payload['merge_request']['iid']
+        username = payload['user']['username']
+        if payload.get('event_type') == 'revoke':
+            return lambda store: store.remove_award_emoji(project_id, note['id'], username, attributes.get('name'))
+        merge_request = await self._missing_merge_request(project_id, mr_iid)
+        emoji = {'id': attributes['id'], 'name': attributes.get('name'), 'user': {'username': username}}
+
+        def write(store):
+            if merge_request is not None:
+                store.upsert_merge_requests(project_id, [merge_request])
+            return store.add_award_emoji(project_id, mr_iid, note['id'], emoji) or merge_request is not None
+        return write
+
+    async def _missing_merge_request(self, project_id, mr_iid):
+        """
+        Fetches a merge request that isn't stored yet
+        :return: Merge request dictionary, or None if it is already stored
+        """
+        store = get_store()
+        if await store.run(store.get_merge_request, project_id, mr_iid) is None:
+            return await self._fetch_merge_request(project_id, mr_iid)
+        return None
+
+    async def _fetch_merge_request(self, project_id, mr_iid):
+        response = await gitlab_get(f'/projects/{project_id}/merge_requests/{mr_iid}')
+        return response.json()
+
+    async def refresh(self):
+        """
+        Recomputes the leaderboards of projects changed since the last refresh. Projects
+        without contributor totals, or whose totals are older than the store, are tallied
+        from the store in the aggregation pool.
+        :return: Number of leaderboards recomputed
+        """
+        dirty, self._dirty = self._dirty, set()
+        self.last_refresh_at = time.time()
+        keys = leaderboard_keys()
+        refreshed = 0
+        for project_id in dirty:
+            path = self._paths.get(project_id)
+            matching = [key for key in keys if path and _repository_path(key[0]) == path.lower()]
+            if not matching:
+                continue
+            entry = self._aggregates.get(project_id)
+            store = get_store()
+            version, rows = await store.run(_rows_if_changed, store, project_id, entry[0] if entry else None)
+            if rows is None:
+                aggregate = entry[1]
+            else:
+                aggregate = await tally_in_pool(rows)
+                self._aggregates[project_id] = (version, aggregate)
+            for repository_url, members_only in matching:
+                materialize_leaderboards(repository_url, contributor_list(aggregate, members_only), members_only)
+                refreshed += 1
+        return refreshed
+
+    async def _reconcile_periodically(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as error:
+                logger.error(f"Error reconciling webhook projects: {str(error)}")
+
+    async def reconcile(self):
+        """
+        Syncs every stored project, and every project whose events were dropped, with GitLab
+        the same way a rescan does: merge requests updated since the watermark, then the
+        activity of merge requests that changed. Leaderboards are refreshed afterwards.
+        :return: Dictionary with the reconciled project count, merge requests synced and failed projects
+        """
+        start = time.time()
+        store = get_store()
+        project_ids = set(await store.run(store.synced_projects)) | self._missed
+        self._missed = set()
+        synced = 0
+        failed = []
+        for project_id in sorted(project_ids):
+            try:
+                if project_id not in self._paths:
+                    self._paths[project_id] = await get_project_path(project_id)
+                updated = await sync_merge_requests(project_id)
+                stale = len(await store.run(store.stale_merge_requests, project_id))
+                failures = await sync_merge_request_activity(project_id)
+                if updated or stale:
+                    self._dirty.add(project_id)
+                synced += stale - len(failures)
+            except Exception as error:
+                logger.error(f"Error reconciling project {project_id}: {str(error)}")
+                self._missed.add(project_id)
+                failed.append(project_id)
+        await self.refresh()
+        self.last_reconcile = {
+            'finished_at': time.time(),
+            'duration': time.time() - start,
+            'projects': len(project_ids),
+            'synced_merge_requests': synced,
+            'failed_projects': failed,
+        }
+        logger.info(f"Reconciled {len(project_ids)} projects, synced activity of {synced} merge requests")
+        return self.last_reconcile
+
+    def stats(self):
+        """
+        Returns queue and event statistics
+        :return: Dictionary of statistics
+        """
+        return {
+            'running': self.running,
+            'queue_size': self.queue.qsize() if self.queue is not None else 0,
+            'queue_capacity': self.maxsize,
+            'events': dict(self.counts),
+            'last_event_at': self.last_event_at,
+            'last_refresh_at': self.last_refresh_at,
+            'pending_projects': len(self._dirty),
+            'reconcile_interval': self.reconcile_interval,
+            'last_reconcile': self.last_reconcile,
+        }
+
+def verify_token(token):
+    """
+    Checks the X-Gitlab-Token header against GITLAB_WEBHOOK_SECRET in constant time
+    :param token: Header value, may be None
+    :return: True if the token matches
+    """
+    if not GITLAB_WEBHOOK_SECRET or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), GITLAB_WEBHOOK_SECRET.encode())
+
+def _iso(value):
+    """
+    Normalizes a webhook timestamp to the format of the REST API. Webhooks use
+    '2024-01-31 12:00:00 UTC' on older GitLab versions and ISO 8601 on newer ones.
+    :param value: Timestamp string
+    :return: Timestamp such as '2024-01-31T12:00:00.000Z'
+    """
+    if value.endswith(' UTC'):
+        parsed = datetime.strptime(value, '%Y-%m-%d %H:%M:%S UTC').replace(tzinfo=timezone.utc)
+    else:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%S.') + f'{parsed.microsecond // 1000:03d}Z'
+
+def _write_and_tally(store, project_id, mr_iid, write, tally):
+    """
+    Applies a webhook write on the store's thread, tallying the affected merge request around it
+    :param store: MergeRequestStore
+    :param project_id: ID of the GitLab project
+    :param mr_iid: IID of the affected merge request
+    :param write: Function called with the store, returning True if the store changed
+    :param tally: Whether to tally the merge request before and after the write
+    :return: Tuple of (changed, tally before or None, tally after or None, store version before, store version after)
+    """
+    version_before = store.version(project_id)
+    before = _tally(store, project_id, mr_iid) if tally else None
+    changed = write(store)
+    after = _tally(store, project_id, mr_iid) if tally and changed else None
+    return changed, before, after, version_before, store.version(project_id)
+
+def _tally(store, project_id, mr_iid):
+    """
+    Tallies the stored activity of one merge request
+    :return: Dictionary of username -> participation details
+    """
+    return tally_merge_requests(store.get_raw_activity(project_id, [mr_iid]).values())
+
+def _rows_if_changed(store, project_id, version):
+    """
+    Loads the raw activity of a project unless the store is still at the given version
+    :param store: MergeRequestStore
+    :param project_id: ID of the GitLab project
+    :param version: Store version the caller's totals were tallied at, or None
+    :return: Tuple of (current store version, list of raw rows or None if the version is unchanged)
+    """
+    current = store.version(project_id)
+    if current == version:
+        return current, None
+    return current, list(store.get_raw_activity(project_id).values())
+
+def _merge_request_iid(kind, payload):
+    """
+    Returns the IID of the merge request an event concerns
+    :return: IID, or None for events outside merge requests
+    """
+    if kind == 'merge_request':
+        return payload['object_attributes']['iid']
+    return payload.get('merge_request', {}).get('iid')
+
+def _repository_path(repository_url):
+    path = urlparse(repository_url).path.strip('/').lower()
+    return path[:-len('.git')] if path.endswith('.git') else path
+
+webhook_processor = WebhookProcessor()
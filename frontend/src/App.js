@@ -9,6 +9,8 @@ import LeftPane from './components/LeftPane';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+// Fields rendered by MergeRequestTable; the backend leaves out everything else
+const MERGE_REQUEST_FIELDS = 'id,iid,title,state,created_at,web_url';
 
 function App() {
   const [mergeRequests, setMergeRequests] = useState([]);
@@ -51,7 +53,7 @@ function App() {
     setLoading(true);
     try {
       const response = await axios.get(`${BACKEND_URL}/api/merge-requests`, {
-        params: { total: totalMRs, max_age: maxAge, repository_url: repoUrl }
+        params: { total: totalMRs, max_age: maxAge, repository_url: repoUrl, fields: MERGE_REQUEST_FIELDS }
       });
       const sortedMergeRequests = response.data.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
       setMergeRequests(sortedMergeRequests);
@@ -66,7 +68,7 @@ function App() {
     setParticipantsLoading(true);
     try {
       const response = await axios.get(`${BACKEND_URL}/api/merge-requests-with-participants`, {
-        params: { total: totalMRs, max_age: maxAge, repository_url: repoUrl }
+        params: { total: totalMRs, max_age: maxAge, repository_url: repoUrl, fields: `${MERGE_REQUEST_FIELDS},participants` }
       });
       const sortedMergeRequests = response.data.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
       setMergeRequests(sortedMergeRequests);
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { Button, Typography, LinearProgress, Paper, Grid, CircularProgress } from '@material-ui/core';
+import { Button, ButtonGroup, Typography, LinearProgress, Paper, Grid, CircularProgress } from '@material-ui/core';
 import { Bar } from 'react-chartjs-2';
 import axios from 'axios';
 import { formatDuration, intervalToDuration } from 'date-fns';
@@ -23,18 +23,32 @@ ChartJS.register(
 );
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const LEADERBOARD_TOP = 20;
+const TIME_WINDOWS = [
+  { value: 'all', label: 'All time' },
+  { value: '90d', label: 'Last 90 days' },
+  { value: '30d', label: 'Last 30 days' },
+  { value: '7d', label: 'Last 7 days' },
+];
+const CHARTS = {
+  total: { label: 'Total Contributions', color: 'rgba(75, 192, 192, ' },
+  reacted: { label: 'Reactions', color: 'rgba(255, 206, 86, ' },
+  commented: { label: 'Comments', color: 'rgba(54, 162, 235, ' },
+  committed: { label: 'Commits', color: 'rgba(255, 99, 132, ' },
+  opened: { label: 'Opened MRs', color: 'rgba(153, 102, 255, ' },
+};
 
 function Contributors({ repoUrl }) {
-  const [contributors, setContributors] = useState([]);
   const [loading, setLoading] = useState(false);
+  const [timeWindow, setTimeWindow] = useState('all');
   const [totalContributions, setTotalContributions] = useState({ labels: [], datasets: [] });
   const [reactionsChart, setReactionsChart] = useState({ labels: [], datasets: [] });
   const [commentsChart, setCommentsChart] = useState({ labels: [], datasets: [] });
   const [commitsChart, setCommitsChart] = useState({ labels: [], datasets: [] });
   const [openedMRsChart, setOpenedMRsChart] = useState({ labels: [], datasets: [] });
   const [totalMRs, setTotalMRs] = useState(0);
-  const [estimatedTime, setEstimatedTime] = useState(0);
-  const [remainingTime, setRemainingTime] = useState(0);
+  const [estimatedTime, setEstimatedTime] = useState(null);
+  const [remainingTime, setRemainingTime] = useState(null);
   const [progress, setProgress] = useState(0);
   const [fetchingMRs, setFetchingMRs] = useState(false);
 
@@ -45,9 +59,9 @@ function Contributors({ repoUrl }) {
         params: { repository_url: repoUrl }
       });
       setTotalMRs(response.data.total_merge_requests);
-      const estimatedSeconds = response.data.total_merge_requests * 1.5;
-      setEstimatedTime(estimatedSeconds);
-      setRemainingTime(estimatedSeconds);
+      // Null until a scan has completed and measured the throughput
+      setEstimatedTime(response.data.estimated_time);
+      setRemainingTime(response.data.estimated_time);
     } catch (error) {
       console.error('Error fetching total MRs:', error);
     } finally {
@@ -57,19 +71,76 @@ function Contributors({ repoUrl }) {
 
   const fetchContributors = async () => {
     setLoading(true);
+    setProgress(0);
     try {
-      const response = await axios.get(`${BACKEND_URL}/api/contributors`, {
-        params: { repository_url: repoUrl }
+      const response = await axios.post(`${BACKEND_URL}/api/contributors/jobs`, {
+        repository_url: repoUrl
       });
-      setContributors(response.data.contributors);
-      prepareChartData(response.data.contributors);
+      followJob(response.data.job_id);
     } catch (error) {
-      console.error('Error fetching contributors:', error);
-    } finally {
+      console.error('Error starting contributors scan:', error);
       setLoading(false);
     }
   };
 
+  const followJob = (jobId) => {
+    const events = new EventSource(`${BACKEND_URL}/api/contributors/jobs/${jobId}/events`);
+    const updateProgress = (event) => {
+      const job = JSON.parse(event.data);
+      setProgress(job.progress.percent);
+      if (job.progress.total) {
+        setTotalMRs(job.progress.total);
+      }
+      if (job.progress.eta !== null) {
+        setRemainingTime(job.progress.eta);
+      }
+      if (job.partial_contributors.length > 0) {
+        prepareChartData(job.partial_contributors);
+      }
+    };
+    events.addEventListener('progress', updateProgress);
+    events.addEventListener('completed', async () => {
+      events.close();
+      try {
+        await fetchLeaderboards(timeWindow);
+      } finally {
+        setLoading(false);
+      }
+    });
+    events.addEventListener('failed', (event) => {
+      events.close();
+      console.error('Error fetching contributors:', JSON.parse(event.data).error);
+      setLoading(false);
+    });
+    events.onerror = () => {
+      // EventSource reconnects on its own; only give up once the stream is closed
+      if (events.readyState === EventSource.CLOSED) {
+        setLoading(false);
+      }
+    };
+  };
+
+  const fetchLeaderboards = async (selectedWindow) => {
+    try {
+      const response = await axios.get(`${BACKEND_URL}/api/leaderboards`, {
+        params: { repository_url: repoUrl, window: selectedWindow, top: LEADERBOARD_TOP }
+      });
+      const metrics = response.data.metrics;
+      setTotalContributions(prepareSeries(metrics.total, CHARTS.total));
+      setReactionsChart(prepareSeries(metrics.reacted, CHARTS.reacted));
+      setCommentsChart(prepareSeries(metrics.commented, CHARTS.commented));
+      setCommitsChart(prepareSeries(metrics.committed, CHARTS.committed));
+      setOpenedMRsChart(prepareSeries(metrics.opened, CHARTS.opened));
+    } catch (error) {
+      console.error('Error fetching leaderboards:', error);
+    }
+  };
+
+  const selectTimeWindow = (selectedWindow) => {
+    setTimeWindow(selectedWindow);
+    fetchLeaderboards(selectedWindow);
+  };
+
   const formatTime = (seconds) => {
     const duration = intervalToDuration({ start: 0, end: seconds * 1000 });
     return formatDuration(duration, { format: ['hours', 'minutes', 'seconds'] });
@@ -87,16 +158,20 @@ function Contributors({ repoUrl }) {
     const getValue = typeof keyOrFunction === 'function' ? keyOrFunction : c => c[keyOrFunction];
     const filteredData = contributorsData.filter(c => getValue(c) > 0);
     const sortedData = [...filteredData].sort((a, b) => getValue(b) - getValue(a));
-    const labels = sortedData.map(c => c.username);
-    const data = sortedData.map(getValue);
-    const maxValue = Math.max(...data);
+    return prepareSeries(
+      { labels: sortedData.map(c => c.username), values: sortedData.map(getValue) },
+      { label, color }
+    );
+  };
 
+  const prepareSeries = (series, { label, color }) => {
+    const maxValue = Math.max(...series.values);
     return {
-      labels,
+      labels: series.labels,
       datasets: [{
         label,
-        data,
-        backgroundColor: data.map(value => `${color}${value / maxValue})`),
+        data: series.values,
+        backgroundColor: series.values.map(value => `${color}${value / maxValue})`),
       }]
     };
   };
@@ -170,9 +245,11 @@ function Contributors({ repoUrl }) {
           <Typography variant="body1" gutterBottom>
             Total Merge Requests: {totalMRs}
           </Typography>
-          <Typography variant="body1" gutterBottom>
-            Estimated processing time: {formatTime(estimatedTime)}
-          </Typography>
+          {estimatedTime !== null && (
+            <Typography variant="body1" gutterBottom>
+              Estimated processing time: {formatTime(estimatedTime)}
+            </Typography>
+          )}
           <Button 
             variant="contained" 
             color="primary" 
@@ -191,10 +268,23 @@ function Contributors({ repoUrl }) {
           </Typography>
           <LinearProgress variant="determinate" value={progress} style={{ height: '10px', borderRadius: '5px' }} />
           <Typography variant="body1" style={{ marginTop: '10px' }}>
-            Estimated time remaining: {formatTime(remainingTime)}
+            Estimated time remaining: {remainingTime !== null ? formatTime(remainingTime) : 'calculating...'}
           </Typography>
         </div>
       )}
+      {!loading && totalContributions.labels.length > 0 && (
+        <ButtonGroup color="primary" style={{ marginTop: '20px' }}>
+          {TIME_WINDOWS.map(({ value, label }) => (
+            <Button
+              key={value}
+              variant={timeWindow === value ? 'contained' : 'outlined'}
+              onClick={() => selectTimeWindow(value)}
+            >
+              {label}
+            </Button>
+          ))}
+        </ButtonGroup>
+      )}
       {totalContributions.labels.length > 0 && (
         <Grid container spacing={3}>
           <Grid item xs={12}>